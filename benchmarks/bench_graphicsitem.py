@@ -0,0 +1,95 @@
+"""
+File: bench_graphicsitem.py
+Description: Measure hover and paint throughput of a GraphicsView showing a
+synthetic page of boxes, drawn by ResizableRect items or in batches. Run
+from the repository root with
+PYTHONPATH=. python benchmarks/bench_graphicsitem.py
+"""
+import os
+import time
+import argparse
+import numpy as np
+from PySide2.QtWidgets import QApplication, QGraphicsView
+from PySide2.QtCore import QEvent, QPointF, QRectF, Qt
+from PySide2.QtGui import QColor, QMouseEvent
+from pyqt_corrector.graphicsscene import GraphicsScene
+
+
+def syntheticPage(scene, numBoxes, numLabels=100, seed=0):
+    rng = np.random.default_rng(seed)
+    topLeft = rng.integers(0, 3000, size=(numBoxes, 2)).tolist()
+    size = rng.integers(1, 100, size=(numBoxes, 2)).tolist()
+    labels = rng.integers(numLabels, size=numBoxes).tolist()
+    colors = [QColor.fromHsv(int(360 * i / numLabels), 255, 255)
+              for i in range(numLabels)]
+    for boxId in range(numBoxes):
+        box = QRectF(*topLeft[boxId], *size[boxId])
+        label = labels[boxId]
+        scene.addBox(0, "bench", boxId, "page", f"label{label:03d}", box,
+                     colors[label])
+
+
+def timeit(app, func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+        app.processEvents()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench(app, numBoxes, repeat, batched):
+    scene = GraphicsScene()
+    scene.batched = batched
+    syntheticPage(scene, numBoxes)
+    view = QGraphicsView(scene)
+    view.setMouseTracking(True)
+    view.resize(1024, 1024)
+    view.show()
+    view.fitInView(scene.itemsBoundingRect(), Qt.KeepAspectRatio)
+    app.processEvents()
+    viewport = view.viewport()
+    rng = np.random.default_rng(1)
+    positions = [QPointF(x, y) for x, y in
+                 rng.integers(0, viewport.width(), size=(repeat, 2)).tolist()]
+
+    def hover(i):
+        event = QMouseEvent(QEvent.MouseMove, positions[i], Qt.NoButton,
+                            Qt.NoButton, Qt.NoModifier)
+        QApplication.sendEvent(viewport, event)
+
+    results = {}
+    results["hover"] = timeit(app, hover, repeat)
+    results["paint"] = timeit(app, lambda i: viewport.repaint(), repeat)
+    view.close()
+    return results
+
+
+def main(args):
+    """main
+
+    :args: command line arguments
+
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QApplication([])
+    for numBoxes in args.boxes:
+        results = bench(app, numBoxes, args.repeat, args.batched)
+        print(f"{numBoxes:>9} boxes: " + ", ".join(
+            f"{name} {1e3 * duration:.3f} ms" for name, duration
+            in results.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the cost of a mouse move and of a repaint of "
+        "a GraphicsView showing a synthetic page of boxes.")
+    parser.add_argument(
+        "-b", "--boxes", help="number of boxes of the synthetic pages",
+        nargs="+", default=[10000], type=int)
+    parser.add_argument(
+        "-n", "--repeat", help="number of events per measure", default=100,
+        type=int)
+    parser.add_argument(
+        "--batched", help="draw the boxes in batches", action="store_true")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,99 @@
+"""
+File: bench_tablemodel.py
+Description: Measure the cost of single row edits on a TableModel shown in a
+TableView through its SortFilterProxyModel. Run from the repository root with
+PYTHONPATH=. python benchmarks/bench_tablemodel.py
+"""
+import os
+import time
+import argparse
+import numpy as np
+from PySide2.QtWidgets import QApplication
+from PySide2.QtCore import QRectF, Qt
+from pyqt_corrector.dataset import Dataset, pagePool, labelPool
+from pyqt_corrector.tablemodel import TableModel
+from pyqt_corrector.tableview import TableView
+
+
+def syntheticDataset(numRows, numPages=500, numLabels=100, seed=0):
+    rng = np.random.default_rng(seed)
+    pages = pagePool.encode([
+        f"page-{i:04d}" for i in rng.integers(numPages, size=numRows)])
+    labels = labelPool.encode([
+        f"label{i:03d}" for i in rng.integers(numLabels, size=numRows)])
+    topLeft = rng.integers(0, 3000, size=(numRows, 2))
+    size = rng.integers(1, 100, size=(numRows, 2))
+    boxes = np.concatenate((topLeft, topLeft + size), axis=1).astype(np.int32)
+    scores = rng.random(numRows, dtype=np.float32)
+    return Dataset(["page", "label", "box", "score"], pages, labels, boxes,
+                   scores)
+
+
+def timeit(app, func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+        app.processEvents()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench(app, numRows, repeat):
+    view = TableView()
+    model = TableModel("bench", syntheticDataset(numRows), view)
+    # through the SortFilterProxyModel, like the tabs of the application
+    view.setSourceModel(model)
+    view.show()
+    app.processEvents()
+    rng = np.random.default_rng(1)
+    rows = rng.integers(numRows // 2, size=repeat).tolist()
+    # expose the edited rows to the view before timing, model.index would
+    # fetch them in the first timed edits otherwise
+    model.fetchUpTo(max(rows))
+    app.processEvents()
+    rowDatas = [model.rowAtIndex(row) for row in rows]
+    box = QRectF(10, 10, 20, 20)
+
+    results = {}
+    results["setData"] = timeit(
+        app, lambda i: model.setData(
+            model.index(rows[i], 2), box.translated(i, i), Qt.EditRole),
+        repeat)
+    results["deleteRow"] = timeit(
+        app, lambda i: model.deleteRow(rows[i]), repeat)
+    results["insertRow"] = timeit(
+        app, lambda i: model.insertRow(
+            rows[repeat - i - 1], rowDatas[repeat - i - 1]), repeat)
+    results["appendRow"] = timeit(
+        app, lambda i: model.appendRow(rowDatas[i]), repeat)
+    assert model.totalRowCount() == numRows + repeat
+    view.close()
+    return results
+
+
+def main(args):
+    """main
+
+    :args: command line arguments
+
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QApplication([])
+    for numRows in args.rows:
+        results = bench(app, numRows, args.repeat)
+        print(f"{numRows:>9} rows: " + ", ".join(
+            f"{name} {1e3 * duration:.3f} ms" for name, duration
+            in results.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the view update cost per single row edit of "
+        "a TableModel attached to a TableView.")
+    parser.add_argument(
+        "-r", "--rows", help="number of rows of the synthetic datasets",
+        nargs="+", default=[10000, 100000, 1000000], type=int)
+    parser.add_argument(
+        "-n", "--repeat", help="number of edits per measure", default=100,
+        type=int)
+    args = parser.parse_args()
+    main(args)
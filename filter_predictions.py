@@ -1,7 +1,7 @@
 import os
 import argparse
 import pandas as pd
-from pyqt_corrector.tablemodel import openDataset
+from pyqt_corrector.dataset import readCsv, compression
 
 
 def main(args):
@@ -10,7 +10,7 @@ def main(args):
     :args: command line arguments
 
     """
-    df = openDataset(args.csv_file)
+    df = readCsv(args.csv_file)
     df1 = df.query("tp_fp == 0")
     df2 = df1.query("gt_box != '0x0x0x0'")
     df3 = df2.sort_values(by=["page", "score"])
@@ -21,7 +21,8 @@ def main(args):
     if args.output == "":
         print(df5)
     else:
-        df5.to_csv(args.output, index=False)
+        df5.to_csv(args.output, index=False,
+                   compression=compression(args.output))
 
 
 if __name__ == "__main__":
@@ -29,7 +30,8 @@ if __name__ == "__main__":
         description="Filter predictions from csv file by removing true "
         "positives and false positive associated with an existing manually "
         "labeled symbols. If no output file is specified, print the results to"
-        " the standard output.")
+        " the standard output. Files ending with .gz, .bz2, .xz or .zst are"
+        " compressed.")
     parser.add_argument("csv_file", help="input csv file path", type=str)
     parser.add_argument(
         "-o", "--output", help="output file", default="", type=str)
@@ -1,17 +1,24 @@
 import os
 import glob
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
 from PySide2.QtWidgets import QUndoCommand, QComboBox, QGridLayout, \
-    QLabel
-from PySide2.QtCore import QModelIndex, QMarginsF, Qt
+    QLabel, QGraphicsPixmapItem
+from PySide2.QtCore import QMarginsF, Qt
 from PySide2.QtGui import QPixmap
-from pyqt_corrector.tablemodel import TableModel, openDataset
+from pyqt_corrector.tablemodel import TableModel, annotationId
+from pyqt_corrector.dataset import Dataset
+from pyqt_corrector.loader import DatasetLoader, openDatasetFile
 from pyqt_corrector.tableview import TableView
 from pyqt_corrector.tabwidget import TabWidget, Tab
 from pyqt_corrector.graphicsscene import GraphicsScene
 from pyqt_corrector.graphicsitem import ResizableRect, RectProp
 from pyqt_corrector.smoothview import SmoothView
 
+# threads used to parse the files opened together
+OPEN_WORKERS = min(8, os.cpu_count() or 1)
+
 
 class DeleteDatasetCommand(QUndoCommand):
 
@@ -59,8 +66,8 @@ class DeleteDatasetCommand(QUndoCommand):
             name = os.path.basename(tab.filename)
             self.tabWidget.insertTab(tabIndex, tab, name)
             # print("insert", tabIndex, self.tabIndices, self.tabWidget.count())
-            self.tabWidget.getTableView(tabIndex).clicked.connect(
-                self.tabWidget.cellClicked)
+            if tab.isMaterialized():
+                tab.view.clicked.connect(self.tabWidget.cellClicked)
 
         self.comboBox.blockSignals(True)
         for label in self.tabWidget.labelSet():
@@ -109,8 +116,8 @@ class DeleteDatasetCommand(QUndoCommand):
 
         for tab in self.tabs:
             tabIndex = self.tabWidget.indexOf(tab)
-            view = self.tabWidget.getTableView(tabIndex)
-            view.clicked.disconnect()
+            if tab.isMaterialized():
+                tab.view.clicked.disconnect()
             # print("delete", tabIndex, self.tabIndices, self.tabWidget.count())
             self.tabWidget.removeTab(tabIndex)
 
@@ -145,26 +152,42 @@ class OpenDatasetCommand(QUndoCommand):
     Undoing action will completely undo all of the previous actions,
     including destroying the dataset, freeing memory and reset the state to
     the previous state.
+    Files with a fresh binary sidecar cache are loaded from it. Otherwise,
+    only the first rows of each file are read before creating its tab, the
+    rest of the file is loaded in the background by a DatasetLoader.
+    Columns left in the file by the cache are read by a ColumnLoader.
+    Edits recorded in the journal of a file and never saved are replayed
+    onto it.
+    With lazy, only placeholder tabs are created, each file being read when
+    its tab is first used.
     """
 
     def __init__(self, filenames, tabWidget, comboBox, graphicsScene,
-                 messageLabel, parent=None):
+                 messageLabel, lazy=False, parent=None):
         super().__init__(parent)
         self.filenames = filenames
+        self.lazy = lazy
         self.tabWidget: TabWidget = tabWidget
         self.comboBox: QComboBox = comboBox
         self.graphicsScene: GraphicsScene = graphicsScene
         self.messageLabel: QLabel = messageLabel
         self.tabIndices = []
         self.addedLabels = []
+        self.loaders = []
 
     def undo(self):
+        for loader in self.loaders:
+            loader.stop()
+        self.loaders = []
+
         tabs = [self.tabWidget.widget(tabIndex)
                 for tabIndex in self.tabIndices]
         for tab in tabs:
             tabIndex = self.tabWidget.indexOf(tab)
-            view = self.tabWidget.getTableView(tabIndex)
-            view.clicked.disconnect()
+            if tab.isMaterialized():
+                tab.view.clicked.disconnect()
+                # edits undone before are recorded in the journal
+                tab.model().flushJournal()
             # print("delete", tabIndex, self.tabIndices, self.tabWidget.count())
             self.tabWidget.removeTab(tabIndex)
             tab.deleteLater()
@@ -185,33 +208,20 @@ class OpenDatasetCommand(QUndoCommand):
         removing all items and then redrawing the page + all boxes belonging to
         the page. Previous page and boxes are saved in the constructor.
         """
-        for filename in self.filenames:
-            try:
-                dataset = openDataset(filename)
-            except AssertionError as error:
-                self.messageLabel.setText(str(error))
-                continue
-
-            tab = Tab(filename)
-            name = os.path.basename(filename)
-            self.tabWidget.addTab(tab, name)
-            self.tabIndices.append(self.tabWidget.indexOf(tab))
-            # print("append", self.tabIndices[-1], self.tabIndices, self.tabWidget.count())
-
-            layout = QGridLayout(tab)
-
-            view = TableView(tab)
-            view.clicked.connect(self.tabWidget.cellClicked)
-            view.setCurrentIndexSignal.connect(self.tabWidget.cellIndexChanged)
-            layout.addWidget(view, 0, 0, 1, 1)
-
-            model = TableModel(name, dataset, view)
-            view.setModel(model)
-            view.resizeColumnsToContents()
-            width = view.verticalHeader().width() + 20
-            for col in range(view.model().columnCount(QModelIndex())):
-                width += view.columnWidth(col)
-            view.setMinimumWidth(width)
+        if self.lazy:
+            for filename in self.filenames:
+                self.addTab(Tab(filename, builder=self.buildTab, lazy=True))
+        else:
+            # parse files concurrently, but create their tabs in order, each
+            # one as soon as its file is ready
+            with ThreadPoolExecutor(max_workers=OPEN_WORKERS) as executor:
+                openings = [executor.submit(openDatasetFile, filename)
+                            for filename in self.filenames]
+                for future in openings:
+                    tab = Tab(future.result().filename,
+                              builder=self.buildTab)
+                    if self.buildTab(tab, future.result()):
+                        self.addTab(tab)
 
         self.comboBox.blockSignals(True)
         for label in self.tabWidget.labelSet():
@@ -221,23 +231,103 @@ class OpenDatasetCommand(QUndoCommand):
 
         self.setText(f"Open {self.filenames}")
 
+    def buildTab(self, tab, opening=None):
+        """Create the view and model of a tab from its opened dataset file.
+        Placeholder tabs, lazy or evicted, open their file first, and get
+        an empty dataset, which is never saved, if it cannot be read."""
+        filename = tab.filename
+        if opening is None:
+            opening = openDatasetFile(filename)
+        if opening.error is not None:
+            self.messageLabel.setText(opening.error)
+            if not (tab.lazy or tab.evicted):
+                return False
+            opening.dataset = Dataset.fromDataFrame(
+                pd.DataFrame(columns=["page", "label", "box"]))
+        if opening.message is not None:
+            self.messageLabel.setText(opening.message)
+        if tab.keys is not None and (
+                len(tab.keys) == len(opening.dataset) or
+                opening.chunks is not None and
+                len(tab.keys) >= len(opening.dataset)):
+            # boxes and commands still refer to the IDs of the evicted rows,
+            # the rows of the chunks still to load get the last ones
+            opening.dataset.setKeys(tab.keys)
+
+        name = os.path.basename(filename)
+
+        layout = tab.layout() or QGridLayout(tab)
+
+        view = TableView(tab)
+        view.clicked.connect(self.tabWidget.cellClicked)
+        view.setCurrentIndexSignal.connect(self.tabWidget.cellIndexChanged)
+        layout.addWidget(view, 0, 0, 1, 1)
+
+        model = TableModel(name, opening.dataset, view)
+        model.setJournal(opening.journal)
+        model.complete = opening.error is None
+        view.setSourceModel(model)
+        view.setMinimumWidth(view.resizeLoadedColumnsToContents())
+
+        if opening.chunks is not None:
+            loader = DatasetLoader(filename, opening.chunks,
+                                   opening.firstChunk, opening.columns,
+                                   opening.signature, tab)
+            loader.chunkLoaded.connect(model.appendDataset)
+            loader.completed.connect(model.setComplete)
+            loader.failed.connect(self.messageLabel.setText)
+            model.labelAdded.connect(self.addLoadedLabel)
+            model.complete = False
+            loader.start()
+            self.loaders.append(loader)
+        self.readColumns(tab, model)
+        # the columns are read from the saved file if it is saved before
+        model.sourceChanged.connect(lambda: self.readColumns(tab, model))
+
+        tab.view = view
+        if tab.lazy:
+            for label in model.labelSet():
+                self.addLoadedLabel(label)
+        return True
+
+    def readColumns(self, tab, model):
+        """Read the columns of model left in its source file in the
+        background"""
+        loader = model.columnLoader(tab)
+        if loader is not None:
+            loader.failed.connect(self.messageLabel.setText)
+            loader.start()
+            self.loaders.append(loader)
+
+    def addTab(self, tab):
+        # add the tab once its model exists so that the tabWidget label
+        # registry can pick it up
+        self.tabWidget.addTab(tab, os.path.basename(tab.filename))
+        self.tabIndices.append(self.tabWidget.indexOf(tab))
+
+    def addLoadedLabel(self, label):
+        """Add labels only found in chunks loaded in the background"""
+        if self.comboBox.findText(label) == -1:
+            self.comboBox.blockSignals(True)
+            self.addedLabels.append(label)
+            self.comboBox.addItem(label, Qt.DisplayRole)
+            self.comboBox.blockSignals(False)
+
 
 class SendToCommand(QUndoCommand):
 
     """ Send a row to another tab.
     This action will:
-    * remove a row from origin tab at origin row, which will update all
-      row indices of remaining rows in the tab,
-    * append this row to the target tab
-    * remove corresponding box from graphicsScene, which will update all
-      row indices of other boxes from the same tab
-    * change box color, tab index, row index and tab name
+    * remove a row from origin tab at origin row,
+    * append this row to the target tab with a new ID of the target tab
+    * remove corresponding box from graphicsScene
+    * change box color, tab index, ID and tab name
       (which affect the tooltip)
     * add back the box to the graphicsScene
     Undoing will do exactly the same actions as redo but:
-    * the row and box are inserted back to their original row, which in
-      turn update the row indices of all boxes from the same tab.
-    * restore graphicsScene item and page only if the page was different,
+    * the row and box are inserted back to their original row with their
+      original ID.
+    The box is only moved if it is shown in the graphicsScene.
     """
 
     def __init__(self, originIndex, targetIndex, originRow, tabWidget,
@@ -248,38 +338,51 @@ class SendToCommand(QUndoCommand):
         self.originRow = originRow
         self.tabWidget: TabWidget = tabWidget
         self.graphicsScene: GraphicsScene = graphicsScene
-        self.targetRow = None
-        self.page = self.graphicsScene.page
-        self.items = self.graphicsScene.items()
+        self.originId = self.tabWidget.getTableModel(originIndex).idAtRow(
+            originRow)
+        self.targetId = None
 
     def undo(self):
         originModel = self.tabWidget.getTableModel(self.originIndex)
         targetModel = self.tabWidget.getTableModel(self.targetIndex)
-        rowData = targetModel.rowAtIndex(self.targetRow)
-        targetModel.deleteRow(self.targetRow)
+        targetRow = targetModel.rowOfId(self.targetId)
+        rowData = targetModel.rowAtIndex(targetRow)
+        targetModel.deleteRow(targetRow)
+        rowData["_id"] = self.originId
         originModel.insertRow(self.originRow, rowData)
 
-        self.graphicsScene.page = self.page
-        self.graphicsScene.removeAllItems()
-        for item in self.items:
-            self.graphicsScene.addItem(item)
+        self.moveBox(self.targetIndex, self.targetId, self.originIndex,
+                     self.originId)
 
     def redo(self):
         originModel = self.tabWidget.getTableModel(self.originIndex)
         targetModel = self.tabWidget.getTableModel(self.targetIndex)
+        self.originRow = originModel.rowOfId(self.originId)
         rowData = originModel.rowAtIndex(self.originRow)
         originModel.deleteRow(self.originRow)
+        # IDs of different tabs are unrelated, the row gets a new one in the
+        # target tab, and the same one when redone
+        rowData.pop("_id")
+        if self.targetId is not None:
+            rowData["_id"] = self.targetId
         targetModel.appendRow(rowData)
-        self.targetRow = targetModel.rowCount(QModelIndex()) - 1
+        self.targetId = targetModel.idAtRow(targetModel.totalRowCount() - 1)
 
-        rect = self.graphicsScene.removeBox(self.originIndex, self.originRow)
-        self.graphicsScene.addBox(
-            self.targetIndex, self.tabWidget.tabText(self.targetIndex),
-            self.targetRow, rect.page, rect.label, rect.rect(),
-            self.tabWidget.color_map(self.targetIndex)[rect.label])
+        self.moveBox(self.originIndex, self.originId, self.targetIndex,
+                     self.targetId)
 
         self.setText(f"Sending {self.originRow} from {originModel} to {targetModel}")
 
+    def moveBox(self, fromIndex, fromId, toIndex, toId):
+        """Show the box of an annotation under its ID in another tab"""
+        rect = self.graphicsScene.removeBox(fromIndex, fromId)
+        if rect is None:
+            return
+        self.graphicsScene.addBox(
+            toIndex, self.tabWidget.tabText(toIndex), toId, rect.page,
+            rect.label, rect.rect(),
+            self.tabWidget.color_map(toIndex)[rect.label])
+
 
 class CellClickedCommand(QUndoCommand):
 
@@ -290,8 +393,8 @@ class CellClickedCommand(QUndoCommand):
     * select the new cell
     * move the view to the newly selected box,
     Undoing this action will:
-    * if a new page was shown when doing this action, restore all previous
-      items and page,
+    * if a new page was shown when doing this action, restore the previous
+      page and show its boxes again,
     * restore previous viewport
     * restore previous selected item.
     """
@@ -301,10 +404,10 @@ class CellClickedCommand(QUndoCommand):
                  messageLabel, parent=None):
         super().__init__(parent)
         self.tabIndex = tabIndex
-        self.row = cellIndex.row()
+        self.boxId = annotationId(cellIndex)
         self.col = cellIndex.column()
         self.prevTabIndex = prevTabIndex
-        self.prevRow = prevCellIndex.row()
+        self.prevBoxId = annotationId(prevCellIndex)
         self.prevCol = prevCellIndex.column()
         self.tabWidget: TabWidget = tabWidget
         self.graphicsScene: GraphicsScene = graphicsScene
@@ -313,25 +416,32 @@ class CellClickedCommand(QUndoCommand):
         self.messageLabel: QLabel = messageLabel
         self.previousSceneRect = self.graphicsView.mapToScene(
             graphicsView.viewport().geometry()).boundingRect()
-        self.items = self.graphicsScene.items()
+        # boxes change after this command, only the page image is kept
+        self.background = [
+            item for item in self.graphicsScene.items()
+            if isinstance(item, QGraphicsPixmapItem)]
         self.page = self.graphicsScene.page
         self.label = self.comboBox.currentText()
 
     def undo(self):
-        if self.page != self.graphicsScene.page or \
-                self.tabIndex != self.prevTabIndex:
-            self.graphicsScene.page = self.page
+        restore = self.page != self.graphicsScene.page or \
+            self.tabIndex != self.prevTabIndex
+        if restore:
             self.graphicsScene.removeAllItems()
-            for item in self.items:
+            for item in self.background:
                 self.graphicsScene.addItem(item)
+            self.graphicsScene.page = self.page
         if self.prevTabIndex >= 0:
             self.tabWidget.setCurrentIndex(self.prevTabIndex)
             self.tabWidget.previousCellIndex = self.prevTabIndex
         else:
             self.prevTabIndex = self.tabWidget.currentIndex()
+        if restore and self.page:
+            # colors depend on the current tab
+            self.graphicsScene.addPageBoxes(self.page)
         self.tabWidget.getTableView(self.prevTabIndex).clearSelection()
-        prevCellIndex = self.tabWidget.getCurrentTableModel().index(
-            self.prevRow, self.prevCol)
+        prevCellIndex = self.tabWidget.getCurrentTableModel().indexOfId(
+            self.prevBoxId, self.prevCol)
         self.tabWidget.setCurrentSelectedCell(prevCellIndex)
         self.graphicsView.fitInView(self.previousSceneRect)
         self.graphicsView.setFocus()
@@ -346,7 +456,7 @@ class CellClickedCommand(QUndoCommand):
         self.tabWidget.setCurrentIndex(self.tabIndex)
         self.tabWidget.getTableView(self.tabIndex).clearSelection()
         model = self.tabWidget.getCurrentTableModel()
-        cellIndex = model.index(self.row, self.col)
+        cellIndex = model.indexOfId(self.boxId, self.col)
         self.tabWidget.setCurrentSelectedCell(cellIndex)
         page = model.pageAtIndex(cellIndex)
         if page != self.page:
@@ -368,16 +478,8 @@ class CellClickedCommand(QUndoCommand):
             self.graphicsScene.setPage(page, pixmap)
         if page != self.page or self.tabIndex != self.prevTabIndex:
             self.graphicsScene.removeAllBoxes()
-            for tabIndex, pageData in enumerate(
-                    self.tabWidget.pageDatas(page)):
-                tabName = self.tabWidget.tabText(tabIndex)
-                for rowIndex, rowData in pageData.iterrows():
-                    label = rowData["label"]
-                    color = self.tabWidget.color_map(tabIndex)[label]
-                    self.graphicsScene.addBox(
-                        tabIndex, tabName, rowIndex, page, label,
-                        rowData["box"], color)
-        box = self.graphicsScene.box(self.tabIndex, self.row)
+            self.graphicsScene.addPageBoxes(page)
+        box = self.graphicsScene.box(self.tabIndex, self.boxId)
         boundingRect = box.boundingRect()
         margin_size = min(boundingRect.width(), boundingRect.height()) * 2
         margin = QMarginsF(*([margin_size] * 4))
@@ -388,7 +490,7 @@ class CellClickedCommand(QUndoCommand):
         self.comboBox.setCurrentText(box.label)
         self.comboBox.setCurrentIndex(self.comboBox.findText(self.label))
         self.comboBox.blockSignals(False)
-        self.setText(f"clicked row {self.tabIndex}:{self.row}")
+        self.setText(f"clicked row {self.tabIndex}:{cellIndex.row()}")
 
     def id(self):
         return 4
@@ -398,9 +500,9 @@ class CellClickedCommand(QUndoCommand):
             return False
 
         if self.tabIndex == other.tabIndex:
-            self.row = other.row
+            self.boxId = other.boxId
             self.col = other.col
-            self.setText(f"clicked row {self.tabIndex}:{self.row}")
+            self.setText(other.text())
             return True
 
         return False
@@ -425,26 +527,24 @@ class LabelChangedCommand(QUndoCommand):
 
         self.label = label
         self.tabIndex = tabIndex
-        self.cellIndex = cellIndex
+        self.boxId = annotationId(cellIndex)
         self.tabWidget: TabWidget = tabWidget
         self.graphicsScene: GraphicsScene = graphicsScene
         self.comboBox: QComboBox = comboBox
         self.prevLabel = self.tabWidget.getTableModel(tabIndex).labelAtIndex(
             cellIndex)
-        self.prevColor = self.graphicsScene.box(
-            tabIndex, cellIndex.row()).color
+        self.prevColor = self.graphicsScene.box(tabIndex, self.boxId).color
 
     def undo(self):
-        self.tabWidget.getTableModel(self.tabIndex).setLabel(
-            self.cellIndex.row(), self.prevLabel)
+        model = self.tabWidget.getTableModel(self.tabIndex)
+        model.setLabel(model.rowOfId(self.boxId), self.prevLabel)
         self.comboBox.blockSignals(True)
         self.comboBox.setCurrentText(self.prevLabel)
         self.comboBox.setCurrentIndex(self.comboBox.findText(self.prevLabel))
         self.comboBox.blockSignals(False)
-        self.graphicsScene.box(self.tabIndex, self.cellIndex.row()).setColor(
-            self.prevColor)
-        self.graphicsScene.box(self.tabIndex, self.cellIndex.row()).setLabel(
-            self.prevLabel)
+        box = self.graphicsScene.box(self.tabIndex, self.boxId)
+        box.setColor(self.prevColor)
+        box.setLabel(self.prevLabel)
         self.tabWidget.setCurrentIndex(self.tabIndex)
 
     def redo(self):
@@ -452,13 +552,12 @@ class LabelChangedCommand(QUndoCommand):
         self.comboBox.setCurrentText(self.label)
         self.comboBox.setCurrentIndex(self.comboBox.findText(self.label))
         self.comboBox.blockSignals(False)
-        self.tabWidget.getTableModel(self.tabIndex).setLabel(
-            self.cellIndex.row(), self.label)
+        model = self.tabWidget.getTableModel(self.tabIndex)
+        model.setLabel(model.rowOfId(self.boxId), self.label)
         color_map = self.tabWidget.color_map(self.tabIndex)
-        self.graphicsScene.box(self.tabIndex, self.cellIndex.row()).setColor(
-            color_map[self.label])
-        self.graphicsScene.box(self.tabIndex, self.cellIndex.row()).setLabel(
-            self.label)
+        box = self.graphicsScene.box(self.tabIndex, self.boxId)
+        box.setColor(color_map[self.label])
+        box.setLabel(self.label)
         self.setText(f"Change box label to {self.label}")
 
     def id(self):
@@ -468,8 +567,7 @@ class LabelChangedCommand(QUndoCommand):
         if self.id() != other.id():
             return False
 
-        if self.cellIndex.row() == other.cellIndex.row() and \
-                self.tabIndex == other.tabIndex:
+        if self.boxId == other.boxId and self.tabIndex == other.tabIndex:
             self.label = other.label
             self.setText(f"Change box label to {self.label}")
             return True
@@ -484,12 +582,12 @@ class SelectBoxCommand(QUndoCommand):
     Will also reset the colors of all boxes.
     """
 
-    def __init__(self, tabIndex, rowIndex, tabWidget, graphicsScene,
+    def __init__(self, tabIndex, boxId, tabWidget, graphicsScene,
                  comboBox, parent=None):
         super().__init__(parent)
 
         self.tabIndex = tabIndex
-        self.rowIndex = rowIndex
+        self.boxId = boxId
         self.tabWidget: TabWidget = tabWidget
         self.graphicsScene: GraphicsScene = graphicsScene
         self.comboBox: QComboBox = comboBox
@@ -514,7 +612,7 @@ class SelectBoxCommand(QUndoCommand):
         self.tabWidget.setCurrentIndex(self.tabIndex)
         self.tabWidget.getCurrentTableView().clearSelection()
         model = self.tabWidget.getCurrentTableModel()
-        modelIndex = model.index(self.rowIndex, 2)
+        modelIndex = model.indexOfId(self.boxId, 2)
         self.tabWidget.setCurrentSelectedCell(modelIndex)
         if self.tabIndex != self.previousSelectedTabIndex:
             for tabIndex in range(self.tabWidget.count()):
@@ -525,7 +623,7 @@ class SelectBoxCommand(QUndoCommand):
         self.comboBox.setCurrentText(label)
         self.comboBox.setCurrentIndex(self.comboBox.findText(label))
         self.comboBox.blockSignals(False)
-        self.setText(f"select box {self.tabIndex}:{self.rowIndex}")
+        self.setText(f"select box {self.tabIndex}:{modelIndex.row()}")
 
     def id(self):
         return 2
@@ -535,7 +633,7 @@ class SelectBoxCommand(QUndoCommand):
             return False
 
         if self.tabIndex == other.tabIndex:
-            self.rowIndex = other.rowIndex
+            self.boxId = other.boxId
             return True
 
         return False
@@ -547,32 +645,31 @@ class MoveBoxCommand(QUndoCommand):
     This will modify only the tablemodel with the new box.
     """
 
-    def __init__(self, tabIndex, rowIndex, box, tabWidget, graphicsScene,
+    def __init__(self, tabIndex, boxId, box, tabWidget, graphicsScene,
                  parent=None):
         super().__init__(parent)
 
         self.tabIndex = tabIndex
-        self.rowIndex = rowIndex
+        self.boxId = boxId
         self.box = box
         self.tabWidget: TabWidget = tabWidget
         self.graphicsScene: GraphicsScene = graphicsScene
         model = self.tabWidget.getTableModel(self.tabIndex)
-        modelIndex = model.index(self.rowIndex, 2)
-        self.previousBox = self.tabWidget.getCurrentTableModel().boxAtIndex(
-            modelIndex)
+        modelIndex = model.indexOfId(self.boxId, 2)
+        self.previousBox = model.boxAtIndex(modelIndex)
 
     def undo(self):
         model: TableModel = self.tabWidget.getTableModel(self.tabIndex)
-        modelIndex = model.index(self.rowIndex, 2)
+        modelIndex = model.indexOfId(self.boxId, 2)
         model.setData(modelIndex, self.previousBox, Qt.EditRole)
-        self.graphicsScene.box(self.tabIndex, self.rowIndex).setRect(
+        self.graphicsScene.box(self.tabIndex, self.boxId).setRect(
             self.previousBox)
 
     def redo(self):
         model: TableModel = self.tabWidget.getTableModel(self.tabIndex)
-        modelIndex = model.index(self.rowIndex, 2)
+        modelIndex = model.indexOfId(self.boxId, 2)
         model.setData(modelIndex, self.box, Qt.EditRole)
-        self.graphicsScene.box(self.tabIndex, self.rowIndex).setRect(
+        self.graphicsScene.box(self.tabIndex, self.boxId).setRect(
             self.box)
         self.setText(f"Moving box to {self.box}")
 
@@ -629,29 +726,30 @@ class DeleteItemCommand(QUndoCommand):
         super().__init__(parent)
 
         self.tabIndex = tabIndex
-        self.cellIndex = cellIndex
+        self.boxId = annotationId(cellIndex)
+        self.row = cellIndex.row()
         self.tabWidget: TabWidget = tabWidget
         self.graphicsView: SmoothView = graphicsView
         self.graphicsScene: GraphicsScene = graphicsScene
         self.comboBox: QComboBox = comboBox
-        self.rowData = self.cellIndex.model().rowAtIndex(self.cellIndex.row())
-        self.rect = self.graphicsScene.box(tabIndex, cellIndex.row())
+        self.rowData = cellIndex.model().rowAtIndex(self.row)
+        self.rect = self.graphicsScene.box(tabIndex, self.boxId)
         self.previousSceneRect = self.graphicsView.mapToScene(
             graphicsView.viewport().geometry()).boundingRect()
         
     def undo(self):
         model = self.tabWidget.getTableModel(self.tabIndex)
-        model.insertRow(self.cellIndex.row(), self.rowData)
-        self.graphicsScene.insertBox(self.tabIndex, self.cellIndex.row(),
-                                     self.rect)
+        model.insertRow(self.row, self.rowData)
+        self.graphicsScene.insertBox(self.tabIndex, self.boxId, self.rect)
         self.graphicsView.fitInView(self.previousSceneRect)
         self.comboBox.setCurrentText(self.rect.label)
         self.comboBox.setCurrentIndex(self.comboBox.findText(self.rect.label))
 
     def redo(self):
         model = self.tabWidget.getTableModel(self.tabIndex)
-        model.deleteRow(self.cellIndex.row())
-        self.graphicsScene.removeBox(self.tabIndex, self.cellIndex.row())
+        self.row = model.rowOfId(self.boxId)
+        model.deleteRow(self.row)
+        self.graphicsScene.removeBox(self.tabIndex, self.boxId)
 
 
 class CreateItemCommand(QUndoCommand):
@@ -669,20 +767,20 @@ class CreateItemCommand(QUndoCommand):
 
     def undo(self):
         model: TableModel = self.tabWidget.getTableModel(self.rect.tabIndex)
-        model.deleteRow(self.rect.rowIndex)
-        self.graphicsScene.removeBox(self.rect.tabIndex, self.rect.rowIndex)
+        model.deleteRow(model.rowOfId(self.rect.boxId))
+        self.graphicsScene.removeBox(self.rect.tabIndex, self.rect.boxId)
         self.comboBox.setCurrentText(self.label)
         self.comboBox.setCurrentIndex(self.comboBox.findText(self.label))
 
     def redo(self):
         model: TableModel = self.tabWidget.getTableModel(self.rect.tabIndex)
         rowData = model.makeRowData(self.rect.page, self.rect.label,
-                                    self.rect.rect())
+                                    self.rect.rect(), self.rect.boxId)
         model.appendRow(rowData)
         if self.graphicsScene.box(
-                self.rect.tabIndex, self.rect.rowIndex) is None:
+                self.rect.tabIndex, self.rect.boxId) is None:
             self.graphicsScene.insertBox(
-                self.rect.tabIndex, self.rect.rowIndex, self.rect)
+                self.rect.tabIndex, self.rect.boxId, self.rect)
         self.comboBox.setCurrentText(self.rect.label)
         self.comboBox.setCurrentIndex(self.comboBox.findText(self.rect.label))
 
@@ -744,16 +842,17 @@ class PasteCommand(QUndoCommand):
         prop.tabIndex = self.tabWidget.currentIndex()
         prop.tabName = self.tabWidget.tabText(prop.tabIndex)
         model = self.tabWidget.getTableModel(prop.tabIndex)
-        prop.rowIndex = model.rowCount(QModelIndex())
+        prop.boxId = model.nextId()
         prop.page = self.graphicsScene.page
         prop.box.moveCenter(pos)
         self.rect = ResizableRect.fromProp(prop)
-        self.rowData = model.makeRowData(prop.page, prop.label, prop.box)
+        self.rowData = model.makeRowData(prop.page, prop.label, prop.box,
+                                         prop.boxId)
 
     def undo(self):
-        self.graphicsScene.removeBox(self.rect.tabIndex, self.rect.rowIndex)
+        self.graphicsScene.removeBox(self.rect.tabIndex, self.rect.boxId)
         model = self.tabWidget.getTableModel(self.rect.tabIndex)
-        model.deleteRow(self.rect.rowIndex)
+        model.deleteRow(model.rowOfId(self.rect.boxId))
 
     def redo(self):
         self.graphicsScene.addItem(self.rect)
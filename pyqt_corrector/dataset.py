@@ -0,0 +1,1087 @@
+"""
+File: dataset.py
+Description: Columnar storage of detection datasets.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+
+def parseBox(box):
+    return [int(coord) for coord in box.split("x")]
+
+
+def formatBox(coords):
+    x1, y1, x2, y2 = [int(coord) for coord in coords]
+    return f"{x1}x{y1}x{x2}x{y2}"
+
+
+def parseBoxes(boxes):
+    """Parse a sequence of box strings into a Nx4 int32 array in one pass"""
+    if len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    coords = np.array("x".join(boxes).split("x"), dtype=np.int32)
+    assert coords.shape[0] == 4 * len(boxes), "Invalid box format"
+    return coords.reshape(-1, 4)
+
+
+def formatBoxes(coords):
+    """Format a Nx4 array of coordinates into an array of box strings"""
+    coords = np.asarray(coords, dtype=np.int32).astype(str)
+    boxes = coords[:, 0]
+    for i in range(1, 4):
+        boxes = np.char.add(np.char.add(boxes, "x"), coords[:, i])
+    return boxes
+
+
+class StringPool():
+
+    """Process wide table of interned strings.
+    Each string gets a stable integer code, so that columns with few
+    distinct values are stored, compared and grouped as int32 codes and
+    shared between all open datasets."""
+
+    def __init__(self):
+        self._strings = []
+        self._codes = {}
+        self._array = np.empty(0, dtype=object)
+        self._ranks = np.empty(0, dtype=np.int32)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._strings)
+
+    def code(self, string):
+        string = str(string)
+        code = self._codes.get(string)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(string)
+                if code is None:
+                    code = len(self._strings)
+                    self._strings.append(sys.intern(string))
+                    self._codes[string] = code
+        return code
+
+    def lookup(self, string):
+        """Code of string, -1 if it was never seen"""
+        return self._codes.get(string, -1)
+
+    def string(self, code):
+        return self._strings[code]
+
+    def encode(self, values):
+        values = pd.Series(values, dtype=object).fillna("")
+        codes, uniques = pd.factorize(values)
+        table = np.array([self.code(value) for value in uniques],
+                         dtype=np.int32)
+        return table[codes]
+
+    def decode(self, codes):
+        array = self._array
+        if array.shape[0] != len(self._strings):
+            # datasets may be opened from several threads
+            with self._lock:
+                array = self._array = np.array(self._strings, dtype=object)
+        return array[codes]
+
+    def ranks(self):
+        """Rank of each code in the lexical order of the strings. Ranks
+        change when new strings are added, see len()."""
+        with self._lock:
+            if self._ranks.shape[0] != len(self._strings):
+                order = np.argsort(np.array(self._strings, dtype=str),
+                                   kind="stable")
+                ranks = np.empty(len(order), dtype=np.int32)
+                ranks[order] = np.arange(len(order), dtype=np.int32)
+                self._ranks = ranks
+            return self._ranks
+
+
+pagePool = StringPool()
+labelPool = StringPool()
+STRING_POOLS = {"page": pagePool, "label": labelPool}
+
+
+CSV_OPTIONS = dict(
+    header=0, skipinitialspace=True, skip_blank_lines=True, comment="#",
+    dtype={"page": str, "label": str, "box": str})
+
+# compressed datasets by extension, with the options used to write them.
+# gzip uses the default level of the gzip tool, much faster to write than
+# the one of python for a slightly larger file. zstd needs the zstandard
+# package.
+COMPRESSIONS = {
+    ".gz": {"method": "gzip", "compresslevel": 6},
+    ".bz2": {"method": "bz2"},
+    ".xz": {"method": "xz"},
+    ".zst": {"method": "zstd"},
+}
+DATASET_PATTERNS = ["*.csv"] + [f"*.csv{ext}" for ext in COMPRESSIONS]
+# errors raised when reading an invalid dataset file: AssertionError for
+# missing columns or bad boxes, ImportError for a compression whose module
+# is missing, EOFError and OSError for truncated compressed files
+READ_ERRORS = (AssertionError, ImportError, EOFError, OSError, ValueError,
+               IndexError, KeyError, pd.errors.ParserError,
+               pd.errors.EmptyDataError)
+
+# columns parsed when a dataset is opened from its cache or journal, the
+# other ones are read afterwards from the csv file
+EAGER_DTYPES = {"page": str, "label": str, "box": str, "score": np.float32}
+# values read as missing in the eager columns, the default ones of pandas,
+# the other columns are kept as written
+EAGER_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null"]
+
+
+def compression(filename):
+    """pandas compression option of a dataset file, from its extension.
+    Needed when writing to a temporary file whose extension says
+    nothing."""
+    return COMPRESSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def checkColumns(filename, columns):
+    for i, col in enumerate(["page", "label", "box"]):
+        assert len(columns) > i and columns[i] == col, \
+            f"{filename} does not have column {col} at index {i}"
+
+
+def readCsv(filename):
+    dataset = pd.read_csv(filename, compression=compression(filename),
+                          **CSV_OPTIONS)
+    checkColumns(filename, dataset.columns)
+    return dataset
+
+
+def readCsvHeader(filename):
+    columns = pd.read_csv(filename, nrows=0, compression=compression(
+        filename), **CSV_OPTIONS).columns.tolist()
+    checkColumns(filename, columns)
+    return columns
+
+
+def eagerOptions(filename, columns):
+    """read_csv options only parsing the eager columns among columns"""
+    usecols = [col for col in columns if col in EAGER_DTYPES]
+    return dict(CSV_OPTIONS, usecols=usecols,
+                dtype={col: EAGER_DTYPES[col] for col in usecols},
+                compression=compression(filename))
+
+
+def readColumns(filename, names):
+    """Read some columns of a csv dataset as strings, exactly as they are
+    written in the file"""
+    options = dict(CSV_OPTIONS, usecols=names, dtype=str,
+                   keep_default_na=False, compression=compression(filename))
+    df = pd.read_csv(filename, **options)
+    return {name: df[name].to_numpy(dtype=object) for name in names}
+
+
+def chunkOptions(filename, columns):
+    """read_csv options parsing the eager columns among columns and keeping
+    the other ones as strings, exactly as they are written in the file"""
+    return dict(CSV_OPTIONS, dtype={
+        col: EAGER_DTYPES.get(col, str) for col in columns},
+        keep_default_na=False, na_values={
+            col: EAGER_NA_VALUES for col in columns if col in EAGER_DTYPES},
+        compression=compression(filename))
+
+
+def readCsvChunks(filename, columns, firstChunkSize=10000,
+                  chunkSize=200000):
+    """Read a csv dataset by chunks of rows, all columns being read in the
+    same pass. columns is the readCsvHeader of the file. The first chunk is
+    kept small so that it can be shown quickly. Compressed files are
+    decompressed as they are read."""
+    reader = pd.read_csv(filename, iterator=True,
+                         **chunkOptions(filename, columns))
+    try:
+        chunk = reader.get_chunk(firstChunkSize)
+        while True:
+            yield chunk
+            try:
+                chunk = reader.get_chunk(chunkSize)
+            except StopIteration:
+                return
+    finally:
+        reader.close()
+
+
+def replaceAtomically(filename, write):
+    """Call write on a temporary file next to filename then rename it over
+    filename, so that a crash can never leave filename truncated"""
+    dirname, basename = os.path.split(filename)
+    tmpFilename = os.path.join(dirname, f".{basename}.{os.getpid()}.tmp")
+    try:
+        write(tmpFilename)
+        os.replace(tmpFilename, filename)
+    finally:
+        if os.path.exists(tmpFilename):
+            os.remove(tmpFilename)
+
+
+def writeSnapshot(filename, snapshot):
+    """Save a DatasetSnapshot and refresh its sidecar cache.
+    Only depends on numpy and pandas so that it can run in a worker
+    process. Return the csvSignature of the written file."""
+    snapshot.save(filename)
+    signature = csvSignature(filename)
+    try:
+        saveCache(filename, snapshot.rebased(), signature)
+    except OSError:
+        pass
+    return signature
+
+
+def openDataset(filename):
+    dataset = loadCache(filename)
+    if dataset is None:
+        signature = csvSignature(filename)
+        columns = readCsvHeader(filename)
+        dataset = Dataset.fromDataFrame(
+            pd.read_csv(filename, **eagerOptions(filename, columns)),
+            columns,
+            filename)
+        dataset.sourceSignature = signature
+        try:
+            saveCache(filename, dataset.snapshot(), signature)
+        except OSError:
+            pass
+    return dataset
+
+
+class Dataset():
+
+    """Columnar storage of a detection dataset.
+
+    Each column is kept in its own typed array: page and label as int32
+    codes into the process wide pagePool and labelPool, box as a Nx4 int32
+    array of x1, y1, x2, y2 coordinates and score as float32. Any other
+    column is kept untouched as an object array. Strings are only decoded
+    when a value is read, indexes and counts work on codes.
+
+    Arrays are used as a gap buffer: live rows are stored in
+    [0, gapStart) and [gapEnd, capacity). Inserting or deleting a row moves
+    the gap to that row, which only costs the distance between two
+    consecutive edits, and the gap is doubled when full so that appending a
+    row is amortized O(1). compact() moves the gap back to the end, which
+    makes every column contiguous again.
+
+    Each row also gets a key, stable across insertions and deletions of
+    other rows, used by the page index and as the ID of the annotation.
+    The row of a key is found in O(1).
+
+    Columns other than page, label, box and score may be left in the source
+    csv file, to be read by a ColumnLoader and given to setColumns, or by
+    whoever saves a snapshot. Rows remember their row in the source file
+    for that, -1 for rows added since, whose values of these columns are
+    kept aside by key.
+    """
+
+    def __init__(self, columns, page, label, box, score=None, extra=None,
+                 source=None, sourceRows=None):
+        self.columns = list(columns)
+        self._size = page.shape[0]
+        self._gapStart = self._size
+        self._gapEnd = self._size
+        self._arrays = {"page": page, "label": label, "box": box}
+        if score is not None:
+            self._arrays["score"] = score
+        if extra is not None:
+            self._arrays.update(extra)
+        self._arrays["_key"] = np.arange(self._size, dtype=np.int64)
+        if sourceRows is None:
+            sourceRows = np.arange(self._size, dtype=np.int64)
+        self._arrays["_source"] = sourceRows
+        self.source = source
+        # csvSignature of the source file the rows of _source refer to
+        self.sourceSignature = None
+        self._lazy = {col: {} for col in self.columns
+                      if col not in self._arrays}
+        self._keySlots = np.arange(self._size, dtype=np.int64)
+        self._nextKey = self._size
+        # keys given by setKeys to the rows appended next by extend
+        self._extendKeys = np.empty(0, dtype=np.int64)
+        self._pageKeys = {}
+        self._buildPageIndex()
+        counts = np.bincount(self.rawColumn("label"))
+        self._labelCounts = Counter({
+            code: count for code, count in enumerate(counts.tolist())
+            if count > 0})
+
+    def __len__(self):
+        return self._size
+
+    def __str__(self):
+        return f"Dataset: {(len(self), len(self.columns))}"
+
+    @classmethod
+    def fromDataFrame(cls, df, columns=None, source=None):
+        """Dataset of the rows of df, which may only hold some of columns,
+        the other ones being read from the source csv file. The index of df
+        gives the rows in the source file."""
+        page = pagePool.encode(df["page"])
+        label = labelPool.encode(df["label"])
+        box = parseBoxes(df["box"].tolist())
+        score = None
+        if "score" in df.columns:
+            score = df["score"].to_numpy(dtype=np.float32, copy=True)
+        extra = {col: df[col].to_numpy(dtype=object, copy=True)
+                 for col in df.columns if col not in EAGER_DTYPES}
+        sourceRows = None
+        if source is not None:
+            sourceRows = df.index.to_numpy(dtype=np.int64, copy=True)
+        if columns is None:
+            columns = df.columns
+        return cls(columns, page, label, box, score, extra, source,
+                   sourceRows)
+
+    def snapshot(self):
+        """Copy the dataset into a DatasetSnapshot without reading anything,
+        columns not read yet being left in the source file"""
+        self.compact()
+        lazy = list(self._lazy)
+        arrays = {col: self.rawColumn(col).copy() for col in self.columns
+                  if col not in lazy}
+        arrays["_source"] = self.rawColumn("_source").copy()
+        lazyValues = {}
+        for col, values in self._lazy.items():
+            if values:
+                keys = np.fromiter(values, dtype=np.int64, count=len(values))
+                slots = self._keySlots[keys]
+                alive = slots >= 0
+                lazyValues[col] = (slots[alive], np.array(
+                    list(values.values()), dtype=object)[alive])
+        strings = {}
+        for name, pool in STRING_POOLS.items():
+            # pool codes are only valid in this process, store local ones
+            codes, uniques = pd.factorize(arrays[name])
+            arrays[name] = codes.astype(np.int32)
+            strings[name] = pool.decode(uniques)
+        return DatasetSnapshot(self.columns, arrays, strings, self.source,
+                               lazy, lazyValues, self.sourceSignature)
+
+    def toDataFrame(self):
+        return self.snapshot().toDataFrame()
+
+    def save(self, filename):
+        self.snapshot().save(filename)
+
+    def isLoaded(self, name):
+        return name not in self._lazy
+
+    def lazyColumns(self):
+        """Columns left in the source file"""
+        return list(self._lazy)
+
+    def _loadColumns(self, names):
+        """Read columns left in the source file, blocking"""
+        if not names:
+            return
+        values = {}
+        if self.source is not None:
+            if self.sourceSignature is not None and \
+                    csvSignature(self.source) != self.sourceSignature:
+                raise ValueError(
+                    f"{self.source} changed since it was read")
+            values = readColumns(self.source, names)
+        self.setColumns(names, values)
+
+    def setColumns(self, names, values):
+        """Fill columns left in the source file from values, arrays read
+        from it by readColumns. Columns missing from values are empty."""
+        rows = self._arrays["_source"]
+        for name in names:
+            if name not in self._lazy:
+                continue
+            column = np.full(self.capacity(), "", dtype=object)
+            if name in values:
+                valid = (rows >= 0) & (rows < values[name].shape[0])
+                column[valid] = values[name][rows[valid]]
+            for key, value in self._lazy.pop(name).items():
+                slot = self._keySlots[key]
+                if slot >= 0:
+                    column[slot] = value
+            self._arrays[name] = column
+
+    def _array(self, name):
+        if name in self._lazy:
+            self._loadColumns([name])
+        return self._arrays[name]
+
+    def capacity(self):
+        return self._arrays["page"].shape[0]
+
+    def hasScore(self):
+        return "score" in self._arrays
+
+    def nbytes(self):
+        """Approximate memory used by the dataset, objects of extra columns
+        only counting as pointers"""
+        return (sum(array.nbytes for array in self._arrays.values()) +
+                self._keySlots.nbytes +
+                sum(keys.nbytes for keys in self._pageKeys.values()))
+
+    def _slot(self, row):
+        if row < self._gapStart:
+            return row
+        return row + self._gapEnd - self._gapStart
+
+    def _slots(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        return np.where(rows < self._gapStart, rows,
+                        rows + self._gapEnd - self._gapStart)
+
+    def _rows(self, slots):
+        return np.where(slots < self._gapEnd, slots,
+                        slots - self._gapEnd + self._gapStart)
+
+    def rawColumn(self, name):
+        """Whole column in row order, page and label being codes.
+        This is a view when the gap is at the end, a copy otherwise."""
+        array = self._array(name)
+        if self._gapEnd == self.capacity():
+            return array[:self._gapStart]
+        return np.concatenate((array[:self._gapStart], array[self._gapEnd:]))
+
+    def column(self, name):
+        if name in STRING_POOLS:
+            return STRING_POOLS[name].decode(self.rawColumn(name))
+        return self.rawColumn(name)
+
+    def get(self, name, row):
+        value = self._array(name)[self._slot(row)]
+        if name in STRING_POOLS:
+            return STRING_POOLS[name].string(value)
+        return value
+
+    def take(self, name, rows):
+        values = self._array(name)[self._slots(rows)]
+        if name in STRING_POOLS:
+            return STRING_POOLS[name].decode(values)
+        return values
+
+    def set(self, name, row, value):
+        if name in STRING_POOLS:
+            value = STRING_POOLS[name].code(value)
+        self._array(name)[self._slot(row)] = value
+
+    def key(self, row):
+        """Internal key of a row, stable across edits of other rows"""
+        return int(self._arrays["_key"][self._slot(row)])
+
+    def keyRow(self, key):
+        """Row of the row with key, -1 if it was deleted"""
+        if not 0 <= key < self._nextKey:
+            return -1
+        slot = int(self._keySlots[key])
+        if slot < self._gapStart:
+            return slot
+        return slot - self._gapEnd + self._gapStart
+
+    def nextKey(self):
+        """Key of the next appended row"""
+        return self._nextKey
+
+    def keys(self):
+        return self.rawColumn("_key").copy()
+
+    def setKeys(self, keys):
+        """Give the rows the keys they had in a previous Dataset of the same
+        file, so that keys held elsewhere stay valid. keys may go on past
+        the rows, the keys left are then given to the rows appended by
+        extend, like the remaining chunks of the file. The next key never
+        goes down, so that a key handed out before is not given again."""
+        assert keys.shape[0] >= self._size, "keys do not match the rows"
+        self.compact()
+        rowKeys = keys[:self._size]
+        self._arrays["_key"][:self._size] = rowKeys
+        nextKey = self._nextKey
+        if keys.shape[0] > 0:
+            nextKey = max(nextKey, int(keys.max()) + 1)
+        self._nextKey = 0
+        self._keySlots = np.empty(0, dtype=np.int64)
+        self._newKeys(nextKey)
+        self._keySlots[rowKeys] = np.arange(self._size)
+        self._extendKeys = np.array(keys[self._size:], dtype=np.int64)
+        self._buildPageIndex()
+
+    def row(self, row):
+        """Values of a row. Columns not read yet are read first, since the
+        row may be inserted back once the source file was saved without it,
+        or into another dataset. They are only replaced by the row in the
+        source file if it cannot be read."""
+        if self._lazy and self.source is not None:
+            try:
+                self._loadColumns(list(self._lazy))
+            except READ_ERRORS:
+                pass
+        rowData = {col: (tuple(self.get(col, row)) if col == "box"
+                         else self.get(col, row))
+                   for col in self.columns if col not in self._lazy}
+        rowData["_source"] = (self.source, self.sourceSignature,
+                              int(self.get("_source", row)))
+        rowData["_id"] = self.key(row)
+        return rowData
+
+    def _buildPageIndex(self):
+        """Map each page code to the sorted array of the keys of its rows"""
+        codes = self.rawColumn("page")
+        order = np.argsort(codes, kind="stable")
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        self._pageKeys = {}
+        if codes.shape[0] == 0:
+            return
+        pages = codes[order[np.concatenate(([0], bounds))]]
+        keys = self.rawColumn("_key")
+        self._pageKeys = {
+            page: np.sort(keys[rows]) for page, rows in zip(
+                pages.tolist(), np.split(order, bounds))}
+
+    def _pageCodeRows(self, code):
+        keys = self._pageKeys.get(code)
+        if keys is None:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(self._rows(self._keySlots[keys]))
+
+    def pageRows(self, page):
+        return self._pageCodeRows(pagePool.lookup(page))
+
+    def _countLabel(self, code, count):
+        self._labelCounts[code] += count
+        if self._labelCounts[code] <= 0:
+            del self._labelCounts[code]
+
+    def pageSet(self):
+        return {pagePool.string(code) for code in self._pageKeys}
+
+    def setLabel(self, row, label):
+        slot = self._slot(row)
+        self._countLabel(self._arrays["label"][slot], -1)
+        code = labelPool.code(label)
+        self._arrays["label"][slot] = code
+        self._countLabel(code, 1)
+
+    def setBox(self, row, coords):
+        self.set("box", row, coords)
+
+    def _reserve(self, size):
+        """Grow the gap, at least doubling the capacity"""
+        capacity = self.capacity()
+        if size <= self._size + self._gapEnd - self._gapStart:
+            return
+        newCapacity = max(size, 2 * capacity, 16)
+        gapEnd = self._gapEnd + newCapacity - capacity
+        for col, array in self._arrays.items():
+            newArray = np.empty((newCapacity,) + array.shape[1:],
+                                dtype=array.dtype)
+            newArray[:self._gapStart] = array[:self._gapStart]
+            newArray[gapEnd:] = array[self._gapEnd:]
+            self._arrays[col] = newArray
+        self._gapEnd = gapEnd
+        self._keySlots[self._arrays["_key"][gapEnd:]] = np.arange(
+            gapEnd, newCapacity)
+
+    def _moveGap(self, row):
+        """Move the gap so that it starts at row"""
+        gapStart, gapEnd = self._gapStart, self._gapEnd
+        if row < gapStart:
+            src = slice(row, gapStart)
+            dst = slice(gapEnd - gapStart + row, gapEnd)
+        elif row > gapStart:
+            src = slice(gapEnd, gapEnd + row - gapStart)
+            dst = slice(gapStart, row)
+        else:
+            return
+        for array in self._arrays.values():
+            array[dst] = array[src]
+        self._keySlots[self._arrays["_key"][dst]] = np.arange(
+            dst.start, dst.stop)
+        self._gapEnd = gapEnd - gapStart + row
+        self._gapStart = row
+
+    def compact(self):
+        """Move the gap to the end so that every column is contiguous"""
+        self._moveGap(self._size)
+
+    def _newKeys(self, count):
+        """Reserve count consecutive keys and return the first one"""
+        key = self._nextKey
+        self._nextKey += count
+        if self._nextKey > self._keySlots.shape[0]:
+            keySlots = np.full(max(2 * key, self._nextKey, 16), -1,
+                               dtype=np.int64)
+            keySlots[:key] = self._keySlots[:key]
+            self._keySlots = keySlots
+        return key
+
+    def _takeKey(self, key):
+        """Key of an inserted row: key if it is given and was freed, like the
+        key of a deleted row being inserted back, a new one otherwise"""
+        if key is None or not 0 <= key < self._nextKey or \
+                self._keySlots[key] >= 0:
+            return self._newKeys(1)
+        return key
+
+    def _writeRow(self, slot, key, rowData):
+        """Write rowData at slot. Columns missing from rowData get an empty
+        value, or their value in the source file if rowData comes from
+        it."""
+        for col, array in self._arrays.items():
+            if col in STRING_POOLS:
+                array[slot] = STRING_POOLS[col].code(rowData[col])
+            elif col == "box":
+                array[slot] = rowData[col]
+            elif col == "score":
+                array[slot] = rowData.get(col, np.nan)
+            elif col == "_source":
+                source, signature, sourceRow = rowData.get(
+                    "_source", (None, None, -1))
+                array[slot] = sourceRow if source == self.source and \
+                    source is not None and \
+                    signature == self.sourceSignature else -1
+            elif col != "_key":
+                array[slot] = rowData.get(col, "")
+        for col, values in self._lazy.items():
+            if col in rowData:
+                values[key] = rowData[col]
+
+    def append(self, rowData):
+        self.insert(self._size, rowData)
+
+    def insert(self, row, rowData):
+        self._reserve(self._size + 1)
+        self._moveGap(row)
+        slot = self._gapStart
+        key = self._takeKey(rowData.get("_id"))
+        self._writeRow(slot, key, rowData)
+        self._arrays["_key"][slot] = key
+        self._keySlots[key] = slot
+        self._gapStart += 1
+        self._size += 1
+        self._countLabel(self._arrays["label"][slot], 1)
+        page = self._arrays["page"][slot]
+        keys = self._pageKeys.get(page, np.empty(0, dtype=np.int64))
+        self._pageKeys[page] = np.insert(
+            keys, np.searchsorted(keys, key), key)
+
+    def extend(self, other):
+        """Append all rows of another dataset with the same columns"""
+        count = len(other)
+        if count == 0:
+            return
+        # chunks are read with all their columns, see readCsvChunks
+        assert set(other._lazy) <= set(self._lazy), \
+            "columns left in the source file cannot be appended"
+        self._reserve(self._size + count)
+        self._moveGap(self._size)
+        slots = slice(self._gapStart, self._gapStart + count)
+        for col, array in self._arrays.items():
+            if col == "_source" and other.source != self.source:
+                array[slots] = -1
+            elif col != "_key":
+                array[slots] = other.rawColumn(col)
+        keys = self._extendKeys[:count]
+        self._extendKeys = self._extendKeys[count:]
+        if keys.shape[0] < count:
+            key = self._newKeys(count - keys.shape[0])
+            keys = np.concatenate((keys, np.arange(key, self._nextKey)))
+        for col, values in self._lazy.items():
+            if col in other._lazy:
+                values.update({
+                    int(keys[other.keyRow(otherKey)]): value
+                    for otherKey, value in other._lazy[col].items()})
+            elif other.source != self.source:
+                values.update(zip(keys.tolist(),
+                                  other.rawColumn(col).tolist()))
+        self._arrays["_key"][slots] = keys
+        self._keySlots[keys] = np.arange(slots.start, slots.stop)
+        self._gapStart += count
+        self._size += count
+        for page in other._pageKeys:
+            pageKeys = np.sort(keys[other._pageCodeRows(page)])
+            if page in self._pageKeys:
+                previous = self._pageKeys[page]
+                pageKeys = np.concatenate((previous, pageKeys))
+                if previous[-1] > pageKeys[previous.shape[0]]:
+                    # keys given by setKeys may come in any order
+                    pageKeys.sort()
+            self._pageKeys[page] = pageKeys
+        self._labelCounts.update(other._labelCounts)
+
+    def rebase(self, keys, signature):
+        """The rows with keys were saved in this order in the source file,
+        which now has signature. Rows copied by row() before lose their
+        values of the columns not read yet."""
+        positions = np.full(self._nextKey, -1, dtype=np.int64)
+        positions[keys] = np.arange(keys.shape[0])
+        self.compact()
+        self._arrays["_source"][:self._size] = positions[
+            self._arrays["_key"][:self._size]]
+        for col, values in self._lazy.items():
+            # values of saved rows are now in the file
+            self._lazy[col] = {key: value for key, value in values.items()
+                               if positions[key] < 0}
+        self.sourceSignature = signature
+
+    def delete(self, row):
+        self._moveGap(row)
+        slot = self._gapEnd
+        key = self._arrays["_key"][slot]
+        self._countLabel(self._arrays["label"][slot], -1)
+        page = self._arrays["page"][slot]
+        keys = self._pageKeys[page]
+        keys = np.delete(keys, np.searchsorted(keys, key))
+        if keys.shape[0] > 0:
+            self._pageKeys[page] = keys
+        else:
+            del self._pageKeys[page]
+        self._keySlots[key] = -1
+        self._gapEnd += 1
+        self._size -= 1
+
+    def _values(self, name, rows=None):
+        """Raw values of a column, of all rows or of rows"""
+        if rows is None:
+            return self.rawColumn(name)
+        return self._array(name)[self._slots(rows)]
+
+    def sortKeys(self, name, rows=None):
+        """Keys ordering rows by a column: lexical ranks of pages and
+        labels, x1 then y1 of boxes and values of the other columns.
+        Ranks of pages and labels are only comparable while
+        sortKeysVersion does not change."""
+        values = self._values(name, rows)
+        if name in STRING_POOLS:
+            return STRING_POOLS[name].ranks()[values]
+        if name == "box":
+            return (values[:, 0].astype(np.int64) << 32) + \
+                (values[:, 1].astype(np.int64) + 2 ** 31)
+        if values.dtype == object:
+            return values.astype(str)
+        return values
+
+    def sortKeysVersion(self, name):
+        if name in STRING_POOLS:
+            return len(STRING_POOLS[name])
+        return 0
+
+    def labelMask(self, label, rows=None):
+        """Whether each row, or each of rows, has label"""
+        return self._values("label", rows) == labelPool.lookup(label)
+
+    def labelCount(self, label):
+        return self._labelCounts.get(labelPool.lookup(label), 0)
+
+    def labelSet(self):
+        return {labelPool.string(code) for code in self._labelCounts}
+
+
+class PageIndex():
+
+    """IDs, labels and boxes of the rows of a Dataset grouped by page, kept
+    when the dataset is dropped from memory so that its boxes can still be
+    shown without reading it again"""
+
+    def __init__(self, dataset):
+        codes = dataset.rawColumn("page")
+        order = np.argsort(codes, kind="stable")
+        self.codes = codes[order]
+        self.keys = dataset.rawColumn("_key")[order]
+        self.labels = dataset.rawColumn("label")[order]
+        self.boxes = dataset.rawColumn("box")[order]
+
+    def nbytes(self):
+        return sum(array.nbytes for array in [
+            self.codes, self.keys, self.labels, self.boxes])
+
+    def page(self, page):
+        """IDs, labels and Nx4 boxes of the rows of page, in row order"""
+        code = pagePool.lookup(page)
+        if code < 0:
+            return self.keys[:0], self.labels[:0], self.boxes[:0]
+        start, stop = np.searchsorted(self.codes, [code, code + 1])
+        return (self.keys[start:stop], labelPool.decode(
+            self.labels[start:stop]), self.boxes[start:stop])
+
+
+class DatasetSnapshot():
+
+    """Frozen copy of a Dataset that can be sent to another process.
+    page and label are stored as codes into the strings tables of the
+    snapshot instead of the process wide string pools. lazy columns are
+    still in the source csv file, at the rows given by the _source
+    array, but for the rows given by lazyValues, column -> (rows, values).
+    """
+
+    def __init__(self, columns, arrays, strings, source=None, lazy=(),
+                 lazyValues=None, sourceSignature=None):
+        self.columns = list(columns)
+        self.arrays = arrays
+        self.strings = strings
+        self.source = source
+        self.lazy = list(lazy)
+        self.lazyValues = lazyValues or {}
+        self.sourceSignature = sourceSignature
+
+    def __len__(self):
+        return self.arrays["page"].shape[0]
+
+    def column(self, name):
+        if name in self.lazy:
+            return self._readLazy([name])[name]
+        if name in self.strings:
+            return self.strings[name][self.arrays[name]]
+        return self.arrays[name]
+
+    def _readLazy(self, names):
+        values = {}
+        if self.source is not None and names:
+            if self.sourceSignature is not None and \
+                    csvSignature(self.source) != self.sourceSignature:
+                raise ValueError(
+                    f"{self.source} changed since it was read")
+            values = readColumns(self.source, names)
+        rows = self.arrays["_source"]
+        columns = {}
+        for name in names:
+            column = np.full(len(self), "", dtype=object)
+            if name in values:
+                valid = (rows >= 0) & (rows < values[name].shape[0])
+                column[valid] = values[name][rows[valid]]
+            if name in self.lazyValues:
+                keptRows, keptValues = self.lazyValues[name]
+                column[keptRows] = keptValues
+            columns[name] = column
+        return columns
+
+    def rebased(self):
+        """Snapshot of the file this snapshot was saved in, with all columns
+        but the eager ones left in it"""
+        arrays = {name: array for name, array in self.arrays.items()
+                  if name in EAGER_DTYPES}
+        arrays["_source"] = np.arange(len(self), dtype=np.int64)
+        lazy = [col for col in self.columns if col not in EAGER_DTYPES]
+        return DatasetSnapshot(self.columns, arrays, self.strings, None,
+                               lazy)
+
+    def toDataFrame(self):
+        data = self._readLazy(self.lazy)
+        for col in self.columns:
+            if col == "box":
+                data[col] = formatBoxes(self.column(col))
+            elif col not in data:
+                data[col] = self.column(col)
+        return pd.DataFrame(data, columns=self.columns)
+
+    def save(self, filename):
+        replaceAtomically(filename, lambda path: self.toDataFrame().to_csv(
+            path, index=False, compression=compression(filename)))
+
+
+CACHE_MAGIC = b"PQCCACHE"
+CACHE_VERSION = 3
+CACHE_ALIGN = 64
+# arrays of the cache, other columns are left in the csv file unless they
+# were given as extra columns
+CACHE_ARRAYS = list(EAGER_DTYPES) + ["_source"]
+
+
+def cachePath(filename):
+    """Binary sidecar cache of a csv dataset, hidden next to it"""
+    dirname, basename = os.path.split(filename)
+    return os.path.join(dirname, f".{basename}.cache")
+
+
+def csvSignature(filename):
+    """Size and modification time, used to check that a cache is fresh"""
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _align(offset):
+    return -(-offset // CACHE_ALIGN) * CACHE_ALIGN
+
+
+def _writeCache(filename, header, arrays):
+    """Write a cache file: a json header followed by raw arrays.
+    arrays maps the name of each array to (dtype, shape, write), write
+    being called with the file positioned where the array goes."""
+    offset = 0
+    for name, (dtype, shape, write) in arrays.items():
+        dtype = np.dtype(dtype)
+        header["arrays"][name] = {
+            "dtype": dtype.str, "shape": list(shape), "offset": offset}
+        offset = _align(offset + int(np.prod(shape)) * dtype.itemsize)
+    headerBytes = json.dumps(header).encode("utf-8")
+    start = _align(len(CACHE_MAGIC) + 8 + len(headerBytes))
+
+    def writeFile(path):
+        with open(path, "wb") as file:
+            file.write(CACHE_MAGIC)
+            file.write(len(headerBytes).to_bytes(8, "little"))
+            file.write(headerBytes)
+            for name, (dtype, shape, write) in arrays.items():
+                file.seek(start + header["arrays"][name]["offset"])
+                write(file)
+
+    replaceAtomically(cachePath(filename), writeFile)
+
+
+def _arrayWriter(array):
+    return (array.dtype, array.shape,
+            lambda file: file.write(array.tobytes()))
+
+
+def saveCache(filename, snapshot, signature):
+    """Write a DatasetSnapshot in a binary sidecar of filename.
+    signature is the csvSignature of filename taken before it was read.
+    The file holds a json header followed by raw arrays, page and label
+    being stored as integer codes into string tables, so that it can be
+    memory mapped by loadCache. Extra columns are stored as fixed size
+    unicode arrays, never pickled, columns the snapshot left in the csv file
+    are left there."""
+    arrays = {name: np.ascontiguousarray(snapshot.arrays[name])
+              for name in CACHE_ARRAYS if name in snapshot.arrays}
+    extra = [col for col in snapshot.columns
+             if col not in arrays and col not in snapshot.lazy]
+    for col in extra:
+        arrays[col] = np.asarray(snapshot.arrays[col], dtype=str)
+    header = {"version": CACHE_VERSION, "signature": signature,
+              "columns": snapshot.columns, "extra": extra, "arrays": {},
+              "strings": {name: strings.tolist() for name, strings
+                          in snapshot.strings.items()}}
+    _writeCache(filename, header, {
+        name: _arrayWriter(array) for name, array in arrays.items()})
+
+
+class CacheWriter():
+
+    """Write the sidecar cache of a csv dataset from the Datasets of its
+    chunks, appended in order as they are read.
+    Their cached arrays are spooled to temporary files so that the whole
+    dataset is never held a second time in memory, the other columns are
+    left in the csv file. Failing to write the cache is not an error, the
+    cache is then just not written."""
+
+    def __init__(self, filename, columns, signature):
+        self.filename = filename
+        self.columns = list(columns)
+        self.signature = signature
+        # name -> temporary file, and [dtype, shape of a row, row count]
+        self.files = {}
+        self.specs = {}
+        # pool code -> local code, and local strings, of page and label
+        self.codes = {name: {} for name in STRING_POOLS}
+        self.strings = {name: [] for name in STRING_POOLS}
+        self.failed = False
+
+    def append(self, dataset):
+        if self.failed:
+            return
+        try:
+            for name in CACHE_ARRAYS:
+                if name != "_source" and name not in dataset.columns:
+                    continue
+                array = dataset.rawColumn(name)
+                if name in STRING_POOLS:
+                    array = self._localCodes(name, array)
+                array = np.ascontiguousarray(array)
+                if name not in self.files:
+                    self.files[name] = tempfile.TemporaryFile()
+                    self.specs[name] = [array.dtype, array.shape[1:], 0]
+                self.files[name].write(array.tobytes())
+                self.specs[name][2] += array.shape[0]
+        except OSError:
+            self.discard()
+            self.failed = True
+
+    def _localCodes(self, name, codes):
+        uniques, inverse = np.unique(codes, return_inverse=True)
+        local, strings = self.codes[name], self.strings[name]
+        pool = STRING_POOLS[name]
+        table = np.empty(uniques.shape[0], dtype=np.int32)
+        for i, code in enumerate(uniques.tolist()):
+            if code not in local:
+                local[code] = len(strings)
+                strings.append(pool.string(code))
+            table[i] = local[code]
+        return table[inverse.reshape(-1)]
+
+    def close(self):
+        """Write the cache file from the appended chunks"""
+        if self.failed:
+            return
+        header = {"version": CACHE_VERSION, "signature": self.signature,
+                  "columns": self.columns, "extra": [], "arrays": {},
+                  "strings": self.strings}
+
+        def copier(file):
+            def copy(output):
+                file.seek(0)
+                shutil.copyfileobj(file, output)
+            return copy
+
+        try:
+            _writeCache(self.filename, header, {
+                name: (dtype, (count,) + shape, copier(self.files[name]))
+                for name, (dtype, shape, count) in self.specs.items()})
+        except OSError:
+            self.failed = True
+        finally:
+            self.discard()
+
+    def discard(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+
+def loadCache(filename):
+    """Load a dataset from its binary sidecar if it is still fresh.
+    Numeric arrays are memory mapped copy on write, so they are shared with
+    the OS page cache until modified. Return None if there is no usable
+    cache."""
+    path = cachePath(filename)
+    try:
+        with open(path, "rb") as file:
+            if file.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            headerLength = int.from_bytes(file.read(8), "little")
+            header = json.loads(file.read(headerLength).decode("utf-8"))
+        if header["version"] != CACHE_VERSION or \
+                header["signature"] != csvSignature(filename):
+            return None
+        start = _align(len(CACHE_MAGIC) + 8 + headerLength)
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+            if dtype.hasobject:
+                return None
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    path, mode="c", dtype=dtype, shape=shape,
+                    offset=start + spec["offset"]).view(np.ndarray)
+        extra = {col: arrays.pop(col).astype(object)
+                 for col in header["extra"]}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    for name, pool in STRING_POOLS.items():
+        table = pool.encode(header["strings"][name])
+        arrays[name] = table[arrays[name]]
+    dataset = Dataset(header["columns"], arrays["page"], arrays["label"],
+                      arrays["box"], arrays.get("score"), extra, filename,
+                      arrays["_source"])
+    dataset.sourceSignature = header["signature"]
+    return dataset
@@ -1,3 +1,4 @@
+import numpy as np
 from PySide2.QtWidgets import QGraphicsRectItem, QGraphicsItem, \
     QGraphicsSceneHoverEvent, QGraphicsSceneMouseEvent
 from PySide2.QtCore import Qt, QMarginsF, QRectF
@@ -6,64 +7,107 @@ from PySide2.QtGui import QPainter, QPen, QPainterPath
 
 class ColorRect(QGraphicsRectItem):
 
+    """Rect drawn with a cosmetic pen, dashed when selected.
+    Its pen and geometry are cached, the pen being built again on color and
+    selection changes and the geometry on setRect."""
+
     def __init__(self, color, parent=None):
         super().__init__(parent)
 
         self.color = color
         self.penWidth = 1
+        self._boundingRect = None
+        self._updatePens()
 
     def setColor(self, color):
         self.color = color
-        self.update(self.boundingRect())
+        self._updatePens()
+        self.update()
 
-    def paint(self, painter: QPainter, option, widget):
+    def setRect(self, *args):
+        # QGraphicsRectItem.setRect calls prepareGeometryChange while the
+        # cached geometry still is the one of the previous rect
+        super().setRect(*args)
+        self._clearGeometry()
+
+    def _clearGeometry(self):
+        self._boundingRect = None
+
+    def _updatePens(self):
         pen = QPen(self.color, self.penWidth)
         if self.isSelected():
             pen.setStyle(Qt.DashLine)
         pen.setCosmetic(True)
-        painter.setPen(pen)
+        self._pen = pen
+
+    def itemChange(self, change, value):
+        if change == QGraphicsItem.ItemSelectedHasChanged:
+            self._updatePens()
+        return super().itemChange(change, value)
+
+    def paint(self, painter: QPainter, option, widget):
+        painter.setPen(self._pen)
         painter.drawRect(self.rect())
 
     def boundingRect(self):
-        box = self.rect()
-        viewBox = self.mapRectFromScene(box)
-        margin = QMarginsF(*([self.penWidth] * 4))
-        viewBox += margin
-        box = self.mapRectToScene(viewBox)
-        return box
+        if self._boundingRect is None:
+            margin = QMarginsF(*([self.penWidth] * 4))
+            self._boundingRect = self.rect() + margin
+        return self._boundingRect
+
+
+# handles as fractions of the width and height of their box, starting at
+# topleft, going clockwise
+HANDLE_POSITIONS = [(0, 0), (0.5, 0), (1, 0), (1, 0.5), (1, 1), (0.5, 1),
+                    (0, 1), (0, 0.5)]
+# (column, row) of a handle among the left, center and right columns and
+# the top, center and bottom rows -> handle index
+HANDLE_INDICES = {(int(2 * x), int(2 * y)): i
+                  for i, (x, y) in enumerate(HANDLE_POSITIONS)}
+
+
+def _segmentPoint(value, start, length, reach):
+    """0, 1 or 2 if value is within reach of the start, the center or the
+    end of a segment, the closest one on segments too short for the three
+    zones to be apart, None otherwise"""
+    distances = [abs(value - (start + i * length / 2)) for i in range(3)]
+    closest = min(range(3), key=distances.__getitem__)
+    return closest if distances[closest] <= reach else None
 
 
 class ResizableRect(ColorRect):
 
-    """Resizable rect showing a bounding box"""
+    """Resizable rect showing a bounding box.
+    Its eight resize handles are painted by the item itself while it is
+    hovered or selected, and found from the mouse position by arithmetic,
+    so that a box is a single item of the scene."""
 
-    def __init__(self, signalHandler, tabIndex, tabName, rowIndex, page, label, box,
-                 color, parent=None):
+    def __init__(self, signalHandler, tabIndex, tabName, boxId, page, label,
+                 box, color, parent=None):
         """Constructor
 
         """
         super().__init__(color, parent)
-        # handle starting at topleft, going clockwise
+        self._handleRects = None
+        self._shape = None
         self.signalHandler = signalHandler
-        self.handles = [ColorRect(color, self) for _ in range(8)]
         self.setVisible(True)
         self.setAcceptHoverEvents(True)
-        self.setFiltersChildEvents(True)
         self.setFlags(
             QGraphicsItem.ItemIsMovable | QGraphicsItem.ItemIsSelectable)
-        self.setHandlesVisible(False)
+        self.handlesVisible = False
         self.handleSelected = None
         self.buttonDownRect = None
         self.setRect(box)
         self.setToolTip(f"{tabName}: {label}")
         self.tabIndex = tabIndex
-        self.rowIndex = rowIndex
+        self.boxId = boxId
         self.page = page
         self.label = label
         self.tabName = tabName
 
     def __str__(self):
-        return f"ResizableRect: {self.tabIndex} {self.tabName} {self.rowIndex}"
+        return f"ResizableRect: {self.tabIndex} {self.tabName} {self.boxId}"
 
     def setTabName(self, tabName):
         self.tabName = tabName
@@ -76,50 +120,49 @@ class ResizableRect(ColorRect):
     def handleSize(self):
         box = self.rect()
         width, height = box.width(), box.height()
-        handle_size = min(width / 3, height / 3)
+        handle_size = max(min(width / 3, height / 3), 2)
         return handle_size
 
-    def setHandlesPos(self):
+    def handleRects(self):
+        if self._handleRects is None:
+            box = self.rect()
+            handle_size = self.handleSize()
+            half_handle_size = handle_size / 2
+            self._handleRects = [
+                QRectF(box.left() + x * box.width() - half_handle_size,
+                       box.top() + y * box.height() - half_handle_size,
+                       handle_size, handle_size)
+                for x, y in HANDLE_POSITIONS]
+        return self._handleRects
+
+    def _clearGeometry(self):
+        super()._clearGeometry()
+        self._handleRects = None
+        self._shape = None
+
+    def _updatePens(self):
+        super()._updatePens()
+        self._handlePen = QPen(self._pen)
+        self._handlePen.setStyle(Qt.SolidLine)
+
+    def handleAt(self, pos):
+        """Index of the handle at pos, None if there is none"""
         box = self.rect()
-        handle_size = max(self.handleSize(), 2)
-        half_handle_size = handle_size / 2
-        self.handles[0].setRect(
-            box.left() - half_handle_size, box.top() - half_handle_size,
-            handle_size, handle_size)
-        self.handles[1].setRect(
-            box.center().x() - half_handle_size, box.top() - half_handle_size,
-            handle_size, handle_size)
-        self.handles[2].setRect(
-            box.right() - half_handle_size, box.top() - half_handle_size,
-            handle_size, handle_size)
-        self.handles[3].setRect(
-            box.right() - half_handle_size, box.center().y() -
-            half_handle_size, handle_size, handle_size)
-        self.handles[4].setRect(
-            box.right() - half_handle_size, box.bottom() - half_handle_size,
-            handle_size, handle_size)
-        self.handles[5].setRect(
-            box.center().x() - half_handle_size, box.bottom() -
-            half_handle_size, handle_size, handle_size)
-        self.handles[6].setRect(
-            box.left() - half_handle_size, box.bottom() - half_handle_size,
-            handle_size, handle_size)
-        self.handles[7].setRect(
-            box.left() - half_handle_size, box.center().y() - half_handle_size,
-            handle_size, handle_size)
-
-    def setRect(self, *args):
-        super().setRect(*args)
-        self.setHandlesPos()
+        reach = self.handleSize() / 2 + self.penWidth
+        col = _segmentPoint(pos.x(), box.left(), box.width(), reach)
+        row = _segmentPoint(pos.y(), box.top(), box.height(), reach)
+        return HANDLE_INDICES.get((col, row))
 
     def setHandlesVisible(self, state):
-        for handle in self.handles:
-            handle.setVisible(state)
+        if state != self.handlesVisible:
+            self.handlesVisible = state
+            self.update()
 
-    def setColor(self, color):
-        for handle in self.handles:
-            handle.setColor(color)
-        super().setColor(color)
+    def paint(self, painter: QPainter, option, widget):
+        super().paint(painter, option, widget)
+        if self.handlesVisible or self.isSelected():
+            painter.setPen(self._handlePen)
+            painter.drawRects(self.handleRects())
 
     def hoverEnterEvent(self, event: QGraphicsSceneHoverEvent):
         self.setHandlesVisible(True)
@@ -140,12 +183,10 @@ class ResizableRect(ColorRect):
 
     def mousePressEvent(self, event: QGraphicsSceneMouseEvent):
         self.signalHandler.boxPressed.emit(
-            self.tabIndex, self.rowIndex)
+            self.tabIndex, self.boxId)
         self.buttonDownRect = QRectF(self.rect())
-        for i, handle in enumerate(self.handles):
-            if handle.boundingRect().contains(event.pos()):
-                if self.handleSelected is None:
-                    self.handleSelected = i
+        if self.handleSelected is None:
+            self.handleSelected = self.handleAt(event.pos())
 
     def mouseReleaseEvent(self, event: QGraphicsSceneMouseEvent):
         if self.handleSelected is not None:
@@ -207,23 +248,26 @@ class ResizableRect(ColorRect):
                          round(new_box.width()),
                          round(new_box.height()))
         self.setRect(new_box)
-        self.setHandlesPos()
         self.signalHandler.boxChanged.emit(
-            self.tabIndex, self.rowIndex, new_box)
+            self.tabIndex, self.boxId, new_box)
 
     def boundingRect(self):
-        rect = super().boundingRect()
-        for handle in self.handles:
-            rect |= handle.boundingRect()
-        return rect
+        if self._boundingRect is None:
+            # handles stick out of the box by half their size
+            margin = self.handleSize() / 2 + self.penWidth
+            self._boundingRect = self.rect() + QMarginsF(*([margin] * 4))
+        return self._boundingRect
 
     def shape(self):
-        path = QPainterPath()
-        path.setFillRule(Qt.WindingFill)
-        path.addRect(self.rect())
-        for handle in self.handles:
-            path.addRect(handle.boundingRect())
-        return path
+        if self._shape is None:
+            path = QPainterPath()
+            path.setFillRule(Qt.WindingFill)
+            path.addRect(self.rect())
+            margin = QMarginsF(*([self.penWidth] * 4))
+            for handle in self.handleRects():
+                path.addRect(handle + margin)
+            self._shape = path
+        return self._shape
 
     @classmethod
     def fromProp(cls, prop):
@@ -231,7 +275,7 @@ class ResizableRect(ColorRect):
             prop.signalHandler,
             prop.tabIndex,
             prop.tabName,
-            prop.rowIndex,
+            prop.boxId,
             prop.page,
             prop.label,
             prop.box,
@@ -244,8 +288,159 @@ class RectProp():
         self.signalHandler = rect.signalHandler
         self.tabIndex = rect.tabIndex
         self.tabName = rect.tabName
-        self.rowIndex = rect.rowIndex
+        self.boxId = rect.boxId
         self.page = rect.page
         self.label = rect.label
         self.box = rect.rect()
         self.color = rect.color
+
+
+class BoxLayer(QGraphicsItem):
+
+    """All boxes of one tab on a page, painted at once with one drawRects
+    call per color instead of one item per box.
+    Boxes shown by a ResizableRect, like the hovered or selected one, are
+    hidden from the layer. Mouse events go through the scene, which finds
+    the box under the cursor with boxAt."""
+
+    def __init__(self, tabIndex, tabName, page, parent=None):
+        super().__init__(parent)
+
+        self.tabIndex = tabIndex
+        self.tabName = tabName
+        self.page = page
+        self.penWidth = 1
+        # boxId -> [label, box, color]
+        self.entries = {}
+        self.hidden = set()
+        # rgba -> (pen, boxes, boxIds) of the shown boxes, painted, and
+        # boxId -> (rgba, index) of a box among them
+        self._groups = None
+        self._slots = None
+        # (boxIds, Nx4 coords, shown) of all boxes, hit tested, and
+        # boxId -> index of a box among them
+        self._coords = None
+        self._rows = None
+        self._boundingRect = QRectF()
+        self.setAcceptedMouseButtons(Qt.NoButton)
+
+    def addBox(self, boxId, label, box, color):
+        box = QRectF(box)
+        bounds = box + QMarginsF(*([self.handleMargin(box)] * 4))
+        if not self._boundingRect.contains(bounds):
+            self.prepareGeometryChange()
+            self._boundingRect |= bounds
+        self.entries[boxId] = [label, box, color]
+        self._invalidate()
+
+    def removeBox(self, boxId):
+        if self.entries.pop(boxId, None) is not None:
+            self._invalidate()
+
+    def setHidden(self, boxIds):
+        self.hidden = set(boxIds)
+        self._invalidate()
+
+    def hideBox(self, boxId):
+        """Hide a box by taking it out of the groups, the other boxes are
+        left as they are"""
+        if boxId in self.hidden:
+            return
+        self.hidden.add(boxId)
+        if boxId not in self.entries:
+            return
+        if self._groups is not None:
+            self._unlist(boxId)
+        if self._coords is not None:
+            self._coords[2][self._rows[boxId]] = False
+        self.update()
+
+    def showBox(self, boxId):
+        if boxId not in self.hidden:
+            return
+        self.hidden.discard(boxId)
+        if boxId not in self.entries:
+            return
+        if self._groups is not None:
+            self._list(boxId)
+        if self._coords is not None:
+            self._coords[2][self._rows[boxId]] = True
+        self.update()
+
+    def setColors(self, color_map):
+        for entry in self.entries.values():
+            entry[2] = color_map[entry[0]]
+        self._invalidate()
+
+    def _invalidate(self):
+        self._groups = None
+        self._slots = None
+        self._coords = None
+        self._rows = None
+        self.update()
+
+    def _list(self, boxId):
+        """Add a box at the end of the group of its color"""
+        label, box, color = self.entries[boxId]
+        rgba = color.rgba()
+        group = self._groups.get(rgba)
+        if group is None:
+            pen = QPen(color, self.penWidth)
+            pen.setCosmetic(True)
+            group = self._groups[rgba] = (pen, [], [])
+        self._slots[boxId] = (rgba, len(group[1]))
+        group[1].append(box)
+        group[2].append(boxId)
+
+    def _unlist(self, boxId):
+        """Remove a box from its group, the last box taking its place"""
+        rgba, index = self._slots.pop(boxId)
+        pen, boxes, boxIds = self._groups[rgba]
+        lastBox, lastId = boxes.pop(), boxIds.pop()
+        if lastId != boxId:
+            boxes[index], boxIds[index] = lastBox, lastId
+            self._slots[lastId] = (rgba, index)
+
+    def handleMargin(self, box):
+        """How far the handles of a ResizableRect stick out of box"""
+        return max(min(box.width() / 3, box.height() / 3), 2) / 2 + \
+            self.penWidth
+
+    def boundingRect(self):
+        return self._boundingRect
+
+    def paint(self, painter: QPainter, option, widget):
+        if self._groups is None:
+            self._groups = {}
+            self._slots = {}
+            for boxId in self.entries:
+                if boxId not in self.hidden:
+                    self._list(boxId)
+        for pen, boxes, boxIds in self._groups.values():
+            painter.setPen(pen)
+            painter.drawRects(boxes)
+
+    def boxAt(self, pos):
+        """ID of the smallest shown box whose ResizableRect would be under
+        pos, None if there is none"""
+        if self._coords is None:
+            boxIds = list(self.entries)
+            coords = np.array([
+                [box.left(), box.top(), box.right(), box.bottom()]
+                for label, box, color in self.entries.values()],
+                dtype=np.float64).reshape(-1, 4)
+            shown = np.array([boxId not in self.hidden for boxId in boxIds],
+                             dtype=bool)
+            self._coords = (np.array(boxIds, dtype=np.int64), coords, shown)
+            self._rows = {boxId: i for i, boxId in enumerate(boxIds)}
+        boxIds, coords, shown = self._coords
+        sizes = coords[:, 2:] - coords[:, :2]
+        margins = np.maximum(sizes.min(axis=1) / 3, 2) / 2 + self.penWidth
+        x, y = pos.x(), pos.y()
+        under = (coords[:, 0] - margins <= x) & (x <= coords[:, 2] + margins) \
+            & (coords[:, 1] - margins <= y) & (y <= coords[:, 3] + margins)
+        candidates = np.flatnonzero(under & shown)
+        if candidates.shape[0] == 0:
+            return None
+        areas = sizes[candidates, 0] * sizes[candidates, 1]
+        return int(boxIds[candidates[np.argmin(areas)]])
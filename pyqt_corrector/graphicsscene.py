@@ -1,8 +1,8 @@
 from PySide2.QtWidgets import QGraphicsScene, QGraphicsSceneMouseEvent, \
     QGraphicsPixmapItem, QComboBox
-from PySide2.QtCore import QObject, Signal, QRectF, Qt, QModelIndex, QSizeF
+from PySide2.QtCore import QObject, Signal, QRectF, Qt, QSizeF
 from PySide2.QtGui import QPixmap
-from pyqt_corrector.graphicsitem import ResizableRect
+from pyqt_corrector.graphicsitem import ResizableRect, BoxLayer
 from pyqt_corrector.tabwidget import TabWidget
 
 
@@ -17,7 +17,12 @@ class SignalHandler(QObject):
 
 class GraphicsScene(QGraphicsScene):
 
-    """Custom GraphicsScene"""
+    """Custom GraphicsScene
+
+    In batched mode, the boxes of each tab are painted by a BoxLayer and
+    only the hovered box and the last one asked through box() are shown by
+    a ResizableRect, which keeps pages with many boxes fluid.
+    """
 
     signalHandler = SignalHandler()
 
@@ -28,32 +33,100 @@ class GraphicsScene(QGraphicsScene):
         self.tabWidget: TabWidget = None
         self.comboBox: QComboBox = None
         self.page = ""
+        # tabIndex -> {boxId: box} of the boxes in the scene
+        self._tabBoxes = {}
+        self.batched = False
+        # tabIndex -> BoxLayer of the batched boxes
+        self._layers = {}
+        # boxes taken out of their layer for the mouse and for box()
+        self._hoverBox = None
+        self._currentBox = None
 
     def mousePressEvent(self, event: QGraphicsSceneMouseEvent):
         if event.button() == Qt.LeftButton and \
                 event.modifiers() & Qt.ControlModifier:
             tabIndex = self.tabWidget.currentIndex()
             tabName = self.tabWidget.tabText(tabIndex)
-            rowIndex = self.tabWidget.getCurrentTableModel().rowCount(
-                QModelIndex())
+            boxId = self.tabWidget.getCurrentTableModel().nextId()
             label = self.comboBox.currentText()
             box = QRectF(event.buttonDownScenePos(Qt.LeftButton), QSizeF(1, 1))
             color = self.tabWidget.color_map(tabIndex)[label]
-            rect = self.addBox(tabIndex, tabName, rowIndex, self.page, label,
-                               box, color)
+            rect = ResizableRect(self.signalHandler, tabIndex, tabName,
+                                 boxId, self.page, label, box, color)
+            self.addItem(rect)
             rect.handleSelected = 4
             self.signalHandler.boxCreated.emit(rect)
         super().mousePressEvent(event)
 
+    def mouseMoveEvent(self, event: QGraphicsSceneMouseEvent):
+        if self._layers and not event.buttons():
+            self.hoverBoxAt(event.scenePos())
+        super().mouseMoveEvent(event)
+
+    def hoverBoxAt(self, pos):
+        """Show the batched box under pos by a ResizableRect"""
+        hoverBox = self._hoverBox
+        if hoverBox is not None and hoverBox.scene() is self and \
+                hoverBox.shape().contains(hoverBox.mapFromScene(pos)):
+            return
+        self._hoverBox = None
+        self._restoreBox(hoverBox)
+        for layer in sorted(self._layers.values(),
+                            key=lambda layer: -layer.zValue()):
+            boxId = layer.boxAt(pos)
+            if boxId is not None:
+                self._hoverBox = self._takeBox(layer, boxId)
+                return
+
+    def _takeBox(self, layer, boxId):
+        label, box, color = layer.entries[boxId]
+        rect = ResizableRect(self.signalHandler, layer.tabIndex,
+                             layer.tabName, boxId, layer.page, label, box,
+                             color)
+        rect.setZValue(layer.zValue())
+        self.addItem(rect)
+        return rect
+
+    def _restoreBox(self, rect):
+        """Give back a box shown by a ResizableRect to its layer"""
+        if rect is None or rect is self._hoverBox or \
+                rect is self._currentBox or rect.isSelected() or \
+                rect.scene() is not self:
+            return
+        layer = self._layers.get(rect.tabIndex)
+        if layer is not None:
+            layer.addBox(rect.boxId, rect.label, rect.rect(), rect.color)
+            self.removeItem(rect)
+
     def addItem(self, item):
         # num = len(self.items())
         # print("PRE addItem:", len(self.items()))
         if isinstance(item, ResizableRect):
             item.signalHandler = self.signalHandler
+            self._tabBoxes.setdefault(item.tabIndex, {})[item.boxId] = item
+            layer = self._layers.get(item.tabIndex)
+            if layer is not None:
+                layer.hideBox(item.boxId)
+        elif isinstance(item, BoxLayer):
+            self._layers[item.tabIndex] = item
+            item.setHidden(self._tabBoxes.get(item.tabIndex, {}))
         super().addItem(item)
         # print("POST addItem:", len(self.items()))
         # assert len(self.items()) == num + 1 + len(item.childItems()), item
 
+    def removeItem(self, item):
+        if isinstance(item, ResizableRect):
+            tabBoxes = self._tabBoxes.get(item.tabIndex, {})
+            if tabBoxes.get(item.boxId) is item:
+                del tabBoxes[item.boxId]
+                layer = self._layers.get(item.tabIndex)
+                if layer is not None:
+                    layer.showBox(item.boxId)
+        elif isinstance(item, BoxLayer):
+            if self._layers.get(item.tabIndex) is item:
+                del self._layers[item.tabIndex]
+        super().removeItem(item)
+
     def setPage(self, page, pixmap: QPixmap):
         # print("PRE setPage:", len(self.items()))
         if self.page != page:
@@ -66,70 +139,120 @@ class GraphicsScene(QGraphicsScene):
         return False
 
     def addBox(self, *args):
+        """Show a box, returns its ResizableRect or None in batched mode"""
         # print("PRE addBox:", len(self.items()))
+        if self.batched:
+            tabIndex, tabName, boxId, page, label, box, color = args
+            layer = self._layers.get(tabIndex)
+            if layer is None:
+                layer = BoxLayer(tabIndex, tabName, page)
+                self.addItem(layer)
+            layer.addBox(boxId, label, box, color)
+            return None
         rect = ResizableRect(self.signalHandler, *args)
         self.addItem(rect)
         # print("POST addBox:", len(self.items()))
         return rect
 
-    def insertBox(self, tabIndex, rowIndex, box):
-        for b in self.boxes():
-            if b.tabIndex == tabIndex and b.rowIndex >= rowIndex:
-                b.rowIndex += 1
+    def addPageBoxes(self, page):
+        """Show the boxes of all tabs on page"""
+        for tabIndex, pageData in enumerate(self.tabWidget.pageDatas(page)):
+            tabName = self.tabWidget.tabText(tabIndex)
+            color_map = self.tabWidget.color_map(tabIndex)
+            for boxId, label, box in pageData:
+                self.addBox(tabIndex, tabName, boxId, page, label, box,
+                            color_map[label])
+
+    def insertBox(self, tabIndex, boxId, box):
         self.addItem(box)
 
-    def removeBox(self, tabIndex, rowIndex):
-        res = None
-        for box in self.boxes():
-            if box.tabIndex == tabIndex and box.rowIndex == rowIndex:
-                self.removeItem(box)
-                res = box
-            elif box.tabIndex == tabIndex and box.rowIndex > rowIndex:
-                box.rowIndex -= 1
+    def removeBox(self, tabIndex, boxId):
+        res = self.box(tabIndex, boxId)
+        if res is not None:
+            layer = self._layers.get(tabIndex)
+            if layer is not None:
+                layer.removeBox(boxId)
+            self.removeItem(res)
         return res
 
     def removeAllBoxes(self):
-        for box in self.boxes():
+        for box in list(self.boxes()):
             self.removeItem(box)
+        for layer in list(self._layers.values()):
+            self.removeItem(layer)
+        self._hoverBox = None
+        self._currentBox = None
 
     def boxes(self):
-        for item in self.items():
-            if isinstance(item, ResizableRect):
-                yield item
+        for tabBoxes in self._tabBoxes.values():
+            yield from tabBoxes.values()
+
+    def tabBoxes(self, tabIndex):
+        return self._tabBoxes.get(tabIndex, {}).values()
 
     def removeAllItems(self):
         # print("PRE removeAllItems:", len(self.items()))
         for item in self.items():
             self.removeItem(item)
         # print("POST removeAllItems:", len(self.items()))
+        self._tabBoxes = {}
+        self._layers = {}
+        self._hoverBox = None
+        self._currentBox = None
         self.page = ""
 
     def removeTabItems(self, tabIndex):
-        removedItems = []
-        for item in self.boxes():
-            if item.tabIndex == tabIndex:
-                self.removeItem(item)
-                removedItems.append(item)
+        removedItems = list(self.tabBoxes(tabIndex))
+        if tabIndex in self._layers:
+            removedItems.append(self._layers[tabIndex])
+        for item in removedItems:
+            self.removeItem(item)
 
         return removedItems
 
     def changeTabIndices(self, index_map):
-        for item in self.boxes():
-            item.tabIndex = index_map[item.tabIndex]
+        tabBoxes = {}
+        for tabIndex, boxes in self._tabBoxes.items():
+            if not boxes:
+                # deleted tab
+                continue
+            for item in boxes.values():
+                item.tabIndex = index_map[tabIndex]
+            tabBoxes[index_map[tabIndex]] = boxes
+        self._tabBoxes = tabBoxes
+        layers = {}
+        for tabIndex, layer in self._layers.items():
+            layer.tabIndex = index_map[tabIndex]
+            layers[layer.tabIndex] = layer
+        self._layers = layers
 
     def changeTabColor(self, tabIndex, color_map):
-        for item in self.boxes():
-            if item.tabIndex == tabIndex:
-                item.setColor(color_map[item.label])
+        for item in self.tabBoxes(tabIndex):
+            item.setColor(color_map[item.label])
+        if tabIndex in self._layers:
+            self._layers[tabIndex].setColors(color_map)
 
-    def box(self, tabIndex: int, rowIndex: int):
-        for item in self.boxes():
-            if item.tabIndex == tabIndex and item.rowIndex == rowIndex:
-                return item
-        raise "Box not found"
+    def box(self, tabIndex: int, boxId: int):
+        """Box of an annotation, None if it is not shown
+        A batched box is taken out of its layer until another one is asked.
+        """
+        box = self._tabBoxes.get(tabIndex, {}).get(boxId)
+        if box is None:
+            layer = self._layers.get(tabIndex)
+            if layer is None or boxId not in layer.entries:
+                return None
+            box = self._takeBox(layer, boxId)
+        if box is self._hoverBox:
+            self._hoverBox = None
+        if box is not self._currentBox:
+            currentBox, self._currentBox = self._currentBox, box
+            self._restoreBox(currentBox)
+        return box
 
     def addTabItemZValue(self, tabIndex, zValue):
-        for item in self.boxes():
-            if item.tabIndex == tabIndex:
-                curZValue = item.zValue()
-                item.setZValue(curZValue + zValue)
+        for item in self.tabBoxes(tabIndex):
+            curZValue = item.zValue()
+            item.setZValue(curZValue + zValue)
+        if tabIndex in self._layers:
+            layer = self._layers[tabIndex]
+            layer.setZValue(layer.zValue() + zValue)
@@ -0,0 +1,144 @@
+"""
+File: journal.py
+Description: Append-only journal of the edits made to a dataset.
+"""
+import os
+import json
+from pyqt_corrector.dataset import replaceAtomically, csvSignature
+
+
+def journalPath(filename):
+    """Journal of a csv dataset, hidden next to it"""
+    dirname, basename = os.path.split(filename)
+    return os.path.join(dirname, f".{basename}.journal")
+
+
+def _toJson(value):
+    # numpy scalars coming from Dataset.row
+    return value.item()
+
+
+class Journal():
+
+    """Append-only log of the edits made to a csv dataset since it was last
+    saved, one json record per line.
+    The first line holds the csvSignature of the file the records apply to
+    and its revision, the following ones are records numbered by the
+    revision they lead to. Rows are addressed by position, as they are in
+    TableModel, so that replaying the records in order onto the csv file
+    recovers the edited dataset.
+    Appended records are kept pending until flush writes and syncs them at
+    once, consecutive edits of the box or label of a same row, like the
+    steps of a drag, being merged into one record meanwhile."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.path = journalPath(filename)
+        self.file = None
+        self.signature = None
+        # revision of the csv file and of the last record
+        self.base = 0
+        self.revision = 0
+        # written and pending lines, and (op, row) of the last pending one
+        self.lines = []
+        self.pending = []
+        self._lastEdit = None
+
+    def __len__(self):
+        return len(self.lines) + len(self.pending)
+
+    def load(self):
+        """Read the records that apply to the current csv file"""
+        self.signature = csvSignature(self.filename)
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                header = json.loads(file.readline())
+                if header["signature"] != self.signature:
+                    # the csv file was saved or replaced afterwards
+                    return []
+                records = [json.loads(line) for line in file if
+                           line.endswith("\n")]
+        except (OSError, ValueError, KeyError):
+            return []
+        self.base = self.revision = header["revision"]
+        if records:
+            self.revision = records[-1]["rev"]
+        self.lines = [json.dumps(record) + "\n" for record in records]
+        return records
+
+    def _rewrite(self):
+        header = {"signature": self.signature, "revision": self.base}
+
+        def write(path):
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(json.dumps(header) + "\n")
+                file.writelines(self.lines)
+
+        replaceAtomically(self.path, write)
+
+    def append(self, record):
+        """Append record until the next flush, return its revision"""
+        self.revision += 1
+        record["rev"] = self.revision
+        line = json.dumps(record, default=_toJson) + "\n"
+        edit = None
+        if record["op"] in ("label", "box"):
+            edit = (record["op"], record["row"])
+        if edit is not None and edit == self._lastEdit:
+            # values are absolute, the last one is enough to replay
+            self.pending[-1] = line
+        else:
+            self.pending.append(line)
+        self._lastEdit = edit
+        return self.revision
+
+    def flush(self):
+        """Durably write the pending records"""
+        if not self.pending:
+            return
+        if self.file is None:
+            if self.signature is None:
+                self.signature = csvSignature(self.filename)
+            self._rewrite()
+            self.file = open(self.path, "a", encoding="utf-8")
+        self.file.writelines(self.pending)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.lines.extend(self.pending)
+        self.pending = []
+        self._lastEdit = None
+
+    def saved(self, revision, signature):
+        """Fold the records up to revision, now written in the csv file with
+        the given signature, out of the journal"""
+        self.close()
+        self.lines = [line for line in self.lines
+                      if json.loads(line)["rev"] > revision]
+        self.base = revision
+        self.signature = signature
+        if self.lines:
+            self._rewrite()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def replayJournal(dataset, records):
+    """Apply journal records onto a Dataset"""
+    for record in records:
+        op = record["op"]
+        if op == "label":
+            dataset.setLabel(record["row"], record["label"])
+        elif op == "box":
+            dataset.setBox(record["row"], record["box"])
+        elif op == "insert":
+            dataset.insert(record["row"], record["data"])
+        elif op == "delete":
+            dataset.delete(record["row"])
+        else:
+            raise ValueError(f"Unknown journal record {op}")
@@ -0,0 +1,146 @@
+from PySide2.QtCore import QThread, Signal
+from pyqt_corrector.dataset import READ_ERRORS, Dataset, CacheWriter, \
+    loadCache, openDataset, csvSignature, readColumns, readCsvChunks, \
+    readCsvHeader
+from pyqt_corrector.journal import Journal, replayJournal
+
+
+class DatasetOpening():
+
+    """Everything read from a dataset file before its tab is created.
+    Made by openDatasetFile, which does not touch Qt objects so that several
+    files can be opened in worker threads."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.journal = Journal(filename)
+        self.dataset = None
+        # remaining chunks to load with a DatasetLoader
+        self.columns = None
+        self.chunks = None
+        self.firstChunk = None
+        self.signature = None
+        self.message = None
+        self.error = None
+
+
+def openDatasetFile(filename):
+    """Open a dataset from its journal, its cache or its first rows"""
+    opening = DatasetOpening(filename)
+    try:
+        records = opening.journal.load()
+    except READ_ERRORS as error:
+        # the csv file itself cannot be read
+        opening.error = f"{filename}: {error}"
+        return opening
+    if records:
+        # edits left unsaved by a previous session, they address rows of
+        # the whole file
+        try:
+            opening.dataset = openDataset(filename)
+            replayJournal(opening.dataset, records)
+        except READ_ERRORS as error:
+            opening.error = f"{filename}: {error}"
+            return opening
+        opening.message = \
+            f"Recovered {len(records)} unsaved edits of {filename}"
+        return opening
+
+    opening.dataset = loadCache(filename)
+    if opening.dataset is None:
+        try:
+            opening.signature = csvSignature(filename)
+            opening.columns = readCsvHeader(filename)
+            opening.chunks = readCsvChunks(filename, opening.columns)
+            opening.firstChunk = next(opening.chunks)
+            opening.dataset = Dataset.fromDataFrame(
+                opening.firstChunk, opening.columns, filename)
+            opening.dataset.sourceSignature = opening.signature
+        except READ_ERRORS as error:
+            if opening.chunks is not None:
+                opening.chunks.close()
+                opening.chunks = None
+            opening.dataset = None
+            opening.error = f"{filename}: {error}"
+    return opening
+
+
+class DatasetLoader(QThread):
+
+    """Parse the remaining chunks of a csv dataset in a worker thread.
+    Each parsed chunk is sent as a Dataset with chunkLoaded, to be appended
+    to the TableModel from the GUI thread.
+    Chunks are also written, as they are parsed, in a binary sidecar cache
+    of the pristine file for the next time it is opened."""
+
+    chunkLoaded = Signal(object)
+    completed = Signal()
+    failed = Signal(str)
+
+    def __init__(self, filename, chunks, firstChunk, columns, signature,
+                 parent=None):
+        super().__init__(parent)
+        self.filename = filename
+        self.chunks = chunks
+        self.firstChunk = firstChunk
+        self.columns = columns
+        self.signature = signature
+
+    def run(self):
+        cache = CacheWriter(self.filename, self.columns, self.signature)
+        cache.append(Dataset.fromDataFrame(self.firstChunk, self.columns,
+                                           self.filename))
+        self.firstChunk = None
+        try:
+            for chunk in self.chunks:
+                if self.isInterruptionRequested():
+                    cache.discard()
+                    return
+                dataset = Dataset.fromDataFrame(chunk, self.columns,
+                                                self.filename)
+                cache.append(dataset)
+                self.chunkLoaded.emit(dataset)
+        except READ_ERRORS as error:
+            cache.discard()
+            self.failed.emit(f"{self.filename}: {error}")
+            return
+        finally:
+            self.chunks.close()
+        self.completed.emit()
+        cache.close()
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
+
+
+class ColumnLoader(QThread):
+
+    """Read the columns of a dataset left in its csv file in a worker thread,
+    all in a single pass. They are sent with columnsLoaded along with the
+    csvSignature of the file they were read from."""
+
+    columnsLoaded = Signal(list, object, object)
+    failed = Signal(str)
+
+    def __init__(self, filename, names, signature, parent=None):
+        super().__init__(parent)
+        self.filename = filename
+        self.names = names
+        self.signature = signature
+
+    def run(self):
+        try:
+            if csvSignature(self.filename) != self.signature:
+                self.failed.emit(f"{self.filename} changed since it was read")
+                return
+            values = readColumns(self.filename, self.names)
+        except READ_ERRORS as error:
+            self.failed.emit(f"{self.filename}: {error}")
+            return
+        if not self.isInterruptionRequested():
+            self.columnsLoaded.emit(self.names, values, self.signature)
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
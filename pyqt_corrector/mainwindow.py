@@ -5,8 +5,9 @@ Email: kwon-young.choi@irisa.fr
 Date: 2019-08-12
 Description: MainWindow
 """
+import os
 from PySide2.QtWidgets import QApplication, QMainWindow, QFileDialog, \
-    QLabel, QUndoStack, QUndoView
+    QLabel, QUndoStack, QUndoView, QAction, QInputDialog
 from PySide2.QtCore import Slot, Qt, QModelIndex, QRectF, QTime, QTimer
 from PySide2.QtGui import QKeySequence, QIcon, QCursor
 from pyqt_corrector.commands import OpenDatasetCommand, DeleteDatasetCommand, \
@@ -15,6 +16,9 @@ from pyqt_corrector.commands import OpenDatasetCommand, DeleteDatasetCommand, \
     CreateItemCommand, ChangeTabItemZValueCommand, CopyCommand, PasteCommand
 from pyqt_corrector.graphicsscene import GraphicsScene
 from pyqt_corrector.graphicsitem import ResizableRect
+from pyqt_corrector.saver import DatasetSaver
+from pyqt_corrector.dataset import DATASET_PATTERNS
+from pyqt_corrector.tablemodel import annotationId
 import data.breeze_icons
 
 
@@ -45,6 +49,14 @@ class MainWindow(QMainWindow):
 
         self.copyList = []
 
+        self.saver = DatasetSaver(self)
+        self.saver.progress.connect(self.messageLabel.setText)
+        self.saver.failed.connect(self.messageLabel.setText)
+        self.saver.batchDone.connect(self.savesDone)
+        # undo stack index and tabs left unsaved of the last save
+        self.savedIndex = 0
+        self.unsavedTabs = []
+
     def setupUi(self):
         if QIcon.themeName() == "":
             QIcon.setThemeName('breeze')
@@ -90,6 +102,34 @@ class MainWindow(QMainWindow):
         self.menuEdit.addAction(self.undoAction)
         self.menuEdit.addAction(self.redoAction)
 
+        self.actionOpen_Lazily = QAction("Open Datasets &Lazily", self)
+        self.actionOpen_Lazily.setCheckable(True)
+        self.actionOpen_Lazily.setToolTip(
+            "Only read a dataset when its tab is first shown")
+        self.menuFile.addAction(self.actionOpen_Lazily)
+        self.tabWidget.tabMaterialized.connect(self.tabMaterialized)
+
+        self.actionMemory_Budget = QAction("Set &Memory Budget...", self)
+        self.actionMemory_Budget.triggered.connect(self.setMemoryBudget)
+        self.menuTools.addAction(self.actionMemory_Budget)
+
+        self.actionFilter_Label = QAction("Show Only Current &Label", self)
+        self.actionFilter_Label.setToolTip(
+            "Only show the rows of the current tab with the selected label")
+        self.actionFilter_Label.triggered.connect(self.filterCurrentLabel)
+        self.menuTools.addAction(self.actionFilter_Label)
+        self.actionClear_Filter = QAction("Show All Rows in &File Order",
+                                          self)
+        self.actionClear_Filter.triggered.connect(self.clearSortFilter)
+        self.menuTools.addAction(self.actionClear_Filter)
+        self.actionBatch_Boxes = QAction("Draw Boxes in &Batches", self)
+        self.actionBatch_Boxes.setCheckable(True)
+        self.actionBatch_Boxes.setToolTip(
+            "Draw the boxes of each tab at once, only the hovered and "
+            "selected boxes can be edited")
+        self.actionBatch_Boxes.toggled.connect(self.setBatchedBoxes)
+        self.menuTools.addAction(self.actionBatch_Boxes)
+
         self.graphicsView.setScene(self.graphicsScene)
         self.graphicsView.mouseMoved.connect(self.coordLabel.setText)
         self.graphicsScene.tabWidget = self.tabWidget
@@ -103,7 +143,7 @@ class MainWindow(QMainWindow):
         originIndex = self.tabWidget.currentIndex()
         numTabs = self.tabWidget.count()
         targetIndex = (numTabs + originIndex - 1) % numTabs
-        modelIndex = self.tabWidget.getCurrentTableView().currentIndex()
+        modelIndex = self.tabWidget.getCurrentSelectedCell()
         if modelIndex.isValid():
             self.undoStack.beginMacro(f"Send item to {targetIndex}")
             sendToCommand = SendToCommand(
@@ -122,7 +162,7 @@ class MainWindow(QMainWindow):
         originIndex = self.tabWidget.currentIndex()
         numTabs = self.tabWidget.count()
         targetIndex = (originIndex + 1) % numTabs
-        modelIndex = self.tabWidget.getCurrentTableView().currentIndex()
+        modelIndex = self.tabWidget.getCurrentSelectedCell()
         if modelIndex.isValid():
             self.undoStack.beginMacro(f"Send item to {targetIndex}")
             sendToCommand = SendToCommand(
@@ -159,13 +199,13 @@ class MainWindow(QMainWindow):
             self,
             QApplication.translate("MainWindow", "Open datasets", None, -1),
             "/home/kwon-young/Documents/PartageVirtualBox/data/omr_dataset/choi_dataset",
-            "*.csv")
+            f"Datasets ({' '.join(DATASET_PATTERNS)})")
         if filenames:
             self.undoStack.beginMacro(f"open Datasets {filenames}")
             filenames.sort()
             openDatasetCommand = OpenDatasetCommand(
                 filenames, self.tabWidget, self.comboBox, self.graphicsScene,
-                self.messageLabel)
+                self.messageLabel, self.actionOpen_Lazily.isChecked())
             self.undoStack.push(openDatasetCommand)
             tabIndex = numTabs
             if self.tabWidget.count() > 0:
@@ -182,6 +222,58 @@ class MainWindow(QMainWindow):
             self.graphicsScene.changeTabColor(
                 tabIndex, self.tabWidget.color_map(tabIndex))
 
+    @Slot()
+    def setMemoryBudget(self):
+        """Ask for the memory budget of the datasets, the least recently
+        used unmodified ones being evicted beyond it"""
+        budget = self.tabWidget.memoryBudget
+        megabytes, ok = QInputDialog.getInt(
+            self, "Memory Budget", "Datasets memory budget in MiB "
+            "(0 for no limit):",
+            0 if budget is None else budget // 2 ** 20, 0, 2 ** 20)
+        if ok:
+            self.tabWidget.setMemoryBudget(
+                megabytes * 2 ** 20 if megabytes > 0 else None)
+
+    @Slot()
+    def filterCurrentLabel(self):
+        if self.tabWidget.count() > 0 and self.comboBox.count() > 0:
+            self.tabWidget.getCurrentTableView().setLabelFilter(
+                self.comboBox.currentText())
+
+    @Slot()
+    def clearSortFilter(self):
+        if self.tabWidget.count() > 0:
+            self.tabWidget.getCurrentTableView().clearSortFilter()
+
+    @Slot(bool)
+    def setBatchedBoxes(self, state):
+        """Draw the boxes of the current page again, in batches or not"""
+        self.graphicsScene.batched = state
+        page = self.graphicsScene.page
+        if not page:
+            return
+        self.graphicsScene.removeAllBoxes()
+        self.graphicsScene.addPageBoxes(page)
+        boxId = annotationId(self.tabWidget.getCurrentSelectedCell())
+        if boxId != -1:
+            self.graphicsScene.box(self.tabWidget.currentIndex(), boxId)
+
+    @Slot(int)
+    def tabMaterialized(self, tabIndex):
+        """Show the boxes of a placeholder tab which was just read"""
+        page = self.graphicsScene.page
+        if page:
+            tabName = self.tabWidget.tabText(tabIndex)
+            model = self.tabWidget.getTableModel(tabIndex)
+            for boxId, label, box in model.pageData(page):
+                self.graphicsScene.addBox(
+                    tabIndex, tabName, boxId, page, label, box,
+                    self.tabWidget.color_map(tabIndex)[label])
+        for tabIndex in range(self.tabWidget.count()):
+            self.graphicsScene.changeTabColor(
+                tabIndex, self.tabWidget.color_map(tabIndex))
+
     @Slot(int, QModelIndex, int, QModelIndex)
     def cellClicked(self, tabIndex, cellIndex, prevTabIndex, prevCellIndex):
         cellClickedCommand = CellClickedCommand(
@@ -196,8 +288,9 @@ class MainWindow(QMainWindow):
             tabIndex = self.tabWidget.currentIndex()
             prevCellIndex = self.tabWidget.getCurrentSelectedCell()
             model = self.tabWidget.getCurrentTableModel()
-            rowCount = model.rowCount(QModelIndex())
-            nextRow = (prevCellIndex.row() + 1) % rowCount
+            nextRow = self.tabWidget.stepRow(prevCellIndex.row(), 1)
+            if nextRow < 0:
+                return
             cellIndex = model.index(nextRow, prevCellIndex.column())
             cellClickedCommand = CellClickedCommand(
                 tabIndex, cellIndex, tabIndex, prevCellIndex, self.tabWidget,
@@ -211,8 +304,9 @@ class MainWindow(QMainWindow):
             tabIndex = self.tabWidget.currentIndex()
             prevCellIndex = self.tabWidget.getCurrentSelectedCell()
             model = self.tabWidget.getCurrentTableModel()
-            rowCount = model.rowCount(QModelIndex())
-            nextRow = (rowCount + prevCellIndex.row() - 1) % rowCount
+            nextRow = self.tabWidget.stepRow(prevCellIndex.row(), -1)
+            if nextRow < 0:
+                return
             cellIndex = model.index(nextRow, prevCellIndex.column())
             cellClickedCommand = CellClickedCommand(
                 tabIndex, cellIndex, tabIndex, prevCellIndex, self.tabWidget,
@@ -227,9 +321,9 @@ class MainWindow(QMainWindow):
             prevCellIndex = self.tabWidget.getCurrentSelectedCell()
             model = self.tabWidget.getCurrentTableModel()
             prevPage = model.pageAtIndex(prevCellIndex)
-            rowCount = model.rowCount(QModelIndex())
+            rowCount = self.tabWidget.shownRowCount()
             for i in range(0, rowCount):
-                row = (prevCellIndex.row() + i) % rowCount
+                row = self.tabWidget.stepRow(prevCellIndex.row(), i)
                 cellIndex = model.index(row, prevCellIndex.column())
                 page = model.pageAtIndex(cellIndex)
                 if prevPage.split("-")[0] != page.split("-")[0]:
@@ -247,9 +341,9 @@ class MainWindow(QMainWindow):
             prevCellIndex = self.tabWidget.getCurrentSelectedCell()
             model = self.tabWidget.getCurrentTableModel()
             prevPage = model.pageAtIndex(prevCellIndex)
-            rowCount = model.rowCount(QModelIndex())
+            rowCount = self.tabWidget.shownRowCount()
             for i in range(0, rowCount):
-                row = (prevCellIndex.row() - i) % rowCount
+                row = self.tabWidget.stepRow(prevCellIndex.row(), -i)
                 cellIndex = model.index(row, prevCellIndex.column())
                 page = model.pageAtIndex(cellIndex)
                 if prevPage.split("-")[0] != page.split("-")[0]:
@@ -299,28 +393,59 @@ class MainWindow(QMainWindow):
 
     @Slot()
     def saveDataToDisk(self):
-        self.undoStack.setClean()
+        self.savedIndex = self.undoStack.index()
+        self.unsavedTabs = []
         for name, model in zip(self.tabWidget.filenames(),
                                self.tabWidget.models()):
-            model.save(name)
+            # placeholder tabs are never modified, and never overwrite a
+            # file with a partially loaded dataset
+            if model is None or not model.isModified():
+                continue
+            if model.complete:
+                self.saver.save(name, model)
+            else:
+                self.unsavedTabs.append(name)
+        if not self.saver.isSaving():
+            self.savesDone([])
+
+    @Slot(list)
+    def savesDone(self, failed):
+        """The edits are only marked as saved once all tabs were written"""
+        if self.unsavedTabs:
+            names = ", ".join(os.path.basename(name)
+                              for name in self.unsavedTabs)
+            self.messageLabel.setText(f"Not saved, still loading: {names}")
+        elif failed:
+            names = ", ".join(os.path.basename(name) for name in failed)
+            self.messageLabel.setText(f"Failed to save {names}")
+        elif self.undoStack.index() == self.savedIndex:
+            self.undoStack.setClean()
+
+    def closeEvent(self, event):
+        # wait for pending saves to be written before quitting
+        self.saver.shutdown()
+        for model in self.tabWidget.models():
+            if model is not None:
+                model.flushJournal()
+        super().closeEvent(event)
 
     @Slot(bool)
     def cleanChanged(self, clean):
         self.setWindowModified(not clean)
 
     @Slot(int, int)
-    def selectBox(self, tabIndex, rowIndex):
-        if tabIndex != self.tabWidget.currentIndex() or \
-                rowIndex != self.tabWidget.getCurrentSelectedCell().row():
+    def selectBox(self, tabIndex, boxId):
+        if tabIndex != self.tabWidget.currentIndex() or boxId != \
+                annotationId(self.tabWidget.getCurrentSelectedCell()):
             selectBoxCommand = SelectBoxCommand(
-                tabIndex, rowIndex, self.tabWidget, self.graphicsScene,
+                tabIndex, boxId, self.tabWidget, self.graphicsScene,
                 self.comboBox)
             self.undoStack.push(selectBoxCommand)
 
     @Slot(int, int, QRectF)
-    def changeBox(self, tabIndex, rowIndex, box):
+    def changeBox(self, tabIndex, boxId, box):
         moveBoxCommand = MoveBoxCommand(
-            tabIndex, rowIndex, box, self.tabWidget, self.graphicsScene)
+            tabIndex, boxId, box, self.tabWidget, self.graphicsScene)
         self.undoStack.push(moveBoxCommand)
 
     @Slot(QRectF, QRectF)
@@ -365,11 +490,11 @@ class MainWindow(QMainWindow):
 
     @Slot(ResizableRect)
     def createItem(self, rect):
-        self.undoStack.beginMacro(f"Create item {rect.tabIndex}:{rect.rowIndex}")
+        self.undoStack.beginMacro(f"Create item {rect.tabIndex}:{rect.boxId}")
         createItemCommand = CreateItemCommand(
             rect, self.tabWidget, self.graphicsScene, self.comboBox)
         self.undoStack.push(createItemCommand)
-        self.selectBox(rect.tabIndex, rect.rowIndex)
+        self.selectBox(rect.tabIndex, rect.boxId)
         self.undoStack.endMacro()
 
     @Slot()
@@ -388,7 +513,7 @@ class MainWindow(QMainWindow):
     def copy(self):
         tabIndex = self.tabWidget.currentIndex()
         cellIndex = self.tabWidget.getCurrentSelectedCell()
-        box = self.graphicsScene.box(tabIndex, cellIndex.row())
+        box = self.graphicsScene.box(tabIndex, annotationId(cellIndex))
         copyCommand = CopyCommand(box, self.copyList)
         self.undoStack.push(copyCommand)
 
@@ -401,5 +526,5 @@ class MainWindow(QMainWindow):
         pasteCommand = PasteCommand(scenePos, prop, self.tabWidget,
                                     self.graphicsScene)
         self.undoStack.push(pasteCommand)
-        self.selectBox(prop.tabIndex, prop.rowIndex)
+        self.selectBox(prop.tabIndex, prop.boxId)
         self.undoStack.endMacro()
@@ -0,0 +1,437 @@
+"""
+File: proxymodel.py
+Description: Sort and filter the rows of a TableModel without touching its
+dataset, so that row indices used by commands and the scene stay valid.
+"""
+import numpy as np
+from PySide2.QtCore import QAbstractProxyModel, QModelIndex, Qt, Slot
+
+
+# column of the labels in a TableModel
+LABEL_COLUMN = 1
+
+
+class SortFilterProxyModel(QAbstractProxyModel):
+
+    """Sorted and filtered view of a TableModel.
+
+    Sorting keeps, per column sorted once, the permutation of the source
+    rows in ascending order and their sort keys, computed with numpy and
+    updated in place when rows are inserted, removed or edited. Filtering
+    keeps a mask of the rows with the filter label. The order of the proxy
+    rows is derived from both, along with its inverse, so that mapping an
+    index either way is a lookup.
+
+    While neither sorting nor filtering, rows are mapped one to one and the
+    source keeps fetching its rows lazily. Otherwise all rows of the source
+    are exposed, since any of them may be shown first."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.sortColumn = -1
+        self.sortOrder = Qt.AscendingOrder
+        self.filterLabel = None
+        # proxy row -> source row and source row -> proxy row, -1 for rows
+        # filtered out, both None while rows are mapped one to one
+        self._order = None
+        self._inverse = None
+        # column -> [source rows sorted by the column, their sorted keys,
+        # version of the keys]
+        self._sorted = {}
+        self._mask = None
+        # (column, order) asked while the column was not read yet
+        self._pendingSort = None
+
+    def setSourceModel(self, model):
+        self.beginResetModel()
+        super().setSourceModel(model)
+        self._sorted = {}
+        self._order = self._inverse = self._mask = None
+        model.rowsAboutToBeInserted.connect(self.sourceRowsAboutToBeInserted)
+        model.rowsInserted.connect(self.sourceRowsInserted)
+        model.rowsAboutToBeRemoved.connect(self.sourceRowsAboutToBeRemoved)
+        model.rowsRemoved.connect(self.sourceRowsRemoved)
+        model.dataChanged.connect(self.sourceDataChanged)
+        model.modelAboutToBeReset.connect(self.beginResetModel)
+        model.modelReset.connect(self.sourceModelReset)
+        self.endResetModel()
+        if self.isActive():
+            self.refresh()
+
+    def isActive(self):
+        """Whether rows are sorted or filtered"""
+        return self.sortColumn >= 0 or self.filterLabel is not None
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        if self._order is None:
+            return self.sourceModel().rowCount(QModelIndex())
+        return len(self._order)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        return self.sourceModel().columnCount(QModelIndex())
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not 0 <= row < self.rowCount() or \
+                not 0 <= column < self.columnCount():
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def canFetchMore(self, parent):
+        if self._order is not None or parent.isValid():
+            return False
+        return self.sourceModel().canFetchMore(QModelIndex())
+
+    def fetchMore(self, parent):
+        if self.canFetchMore(parent):
+            self.sourceModel().fetchMore(QModelIndex())
+
+    def sourceRow(self, row):
+        if self._order is None:
+            return row
+        return int(self._order[row])
+
+    def proxyRow(self, row):
+        """Proxy row of a source row, -1 if it is filtered out"""
+        if self._order is None:
+            return row
+        return int(self._inverse[row])
+
+    def mapToSource(self, proxyIndex):
+        if not proxyIndex.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(
+            self.sourceRow(proxyIndex.row()), proxyIndex.column())
+
+    def mapFromSource(self, sourceIndex):
+        if not sourceIndex.isValid():
+            return QModelIndex()
+        row = self.proxyRow(sourceIndex.row())
+        if row < 0:
+            return QModelIndex()
+        return self.index(row, sourceIndex.column())
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sort by column, -1 restoring the order of the source. Columns
+        still being read from the file are sorted once they are read."""
+        source = self.sourceModel()
+        if column >= 0 and source is not None and \
+                not source.isColumnLoaded(column):
+            self._pendingSort = (column, order)
+            return
+        self._pendingSort = None
+        if column == self.sortColumn and order == self.sortOrder:
+            return
+        self.sortColumn = column
+        self.sortOrder = order
+        self.refresh()
+
+    def setFilterLabel(self, label):
+        """Only show rows with label, None showing all rows"""
+        if label == self.filterLabel:
+            return
+        self.filterLabel = label
+        self.refresh()
+
+    def refresh(self):
+        """Order the rows again after a change of the sort column, of the
+        sort order or of the filter"""
+        source = self.sourceModel()
+        if source is None:
+            return
+        source.fetchAll = self.isActive()
+        if self.isActive():
+            # forwarded one to one while the proxy is not active yet
+            source.fetchUpTo(source.totalRowCount() - 1)
+        self._relayout(self._updateOrder)
+
+    def _updateOrder(self):
+        if not self.isActive():
+            self._order = self._inverse = self._mask = None
+            return
+        source = self.sourceModel()
+        if self.filterLabel is None:
+            self._mask = None
+        else:
+            self._mask = source.labelMask(self.filterLabel)
+        self._order, self._inverse = self._computeOrder()
+
+    def _sortedRows(self, col):
+        """Source rows sorted by col in ascending order"""
+        source = self.sourceModel()
+        version = source.sortKeysVersion(col)
+        entry = self._sorted.get(col)
+        if entry is None or entry[2] != version:
+            keys = source.sortKeys(col)
+            rows = np.argsort(keys, kind="stable")
+            entry = self._sorted[col] = [rows, keys[rows], version]
+        return entry[0]
+
+    def _computeOrder(self):
+        numRows = self.sourceModel().rowCount(QModelIndex())
+        if self.sortColumn >= 0:
+            order = self._sortedRows(self.sortColumn)
+            if self.sortOrder == Qt.DescendingOrder:
+                order = order[::-1]
+        else:
+            order = np.arange(numRows, dtype=np.int64)
+        if self._mask is not None:
+            order = order[self._mask[order]]
+        inverse = np.full(numRows, -1, dtype=np.int64)
+        inverse[order] = np.arange(len(order), dtype=np.int64)
+        return order, inverse
+
+    def _relayout(self, update, remap=None):
+        """Change the order of the rows with update, keeping the indices
+        held by views on the same source rows. remap gives the new source
+        rows of old ones, -1 for removed rows."""
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        rows = np.array([self.sourceRow(index.row()) for index in persistent],
+                        dtype=np.int64)
+        update()
+        if remap is not None:
+            rows = remap(rows)
+        indexes = []
+        for index, row in zip(persistent, rows.tolist()):
+            row = self.proxyRow(row) if row >= 0 else -1
+            indexes.append(QModelIndex() if row < 0
+                           else self.index(row, index.column()))
+        self.changePersistentIndexList(persistent, indexes)
+        self.layoutChanged.emit()
+
+    def _insertSorted(self, first, last):
+        """Make room for the source rows first to last in the sorted rows
+        and the mask"""
+        source = self.sourceModel()
+        count = last - first + 1
+        rows = np.arange(first, last + 1, dtype=np.int64)
+        for col, entry in list(self._sorted.items()):
+            if entry[2] != source.sortKeysVersion(col):
+                del self._sorted[col]
+                continue
+            sortedRows, sortedKeys = entry[0], entry[1]
+            sortedRows = sortedRows + count * (sortedRows >= first)
+            keys = source.sortKeys(col, rows)
+            if count == 1:
+                pos = np.searchsorted(sortedKeys, keys[0], side="right")
+                entry[0] = np.insert(sortedRows, pos, first)
+                entry[1] = np.insert(sortedKeys, pos, keys[0])
+            else:
+                sortedRows = np.concatenate((sortedRows, rows))
+                sortedKeys = np.concatenate((sortedKeys, keys))
+                order = np.argsort(sortedKeys, kind="stable")
+                entry[0] = sortedRows[order]
+                entry[1] = sortedKeys[order]
+        if self._mask is not None:
+            self._mask = np.concatenate((
+                self._mask[:first], source.labelMask(self.filterLabel, rows),
+                self._mask[first:]))
+
+    def _removeSorted(self, first, last):
+        count = last - first + 1
+        for entry in self._sorted.values():
+            sortedRows = entry[0]
+            kept = (sortedRows < first) | (sortedRows > last)
+            sortedRows = sortedRows[kept]
+            entry[0] = sortedRows - count * (sortedRows > last)
+            entry[1] = entry[1][kept]
+        if self._mask is not None:
+            self._mask = np.delete(self._mask, np.s_[first:last + 1])
+
+    def _updateSorted(self, row, cols):
+        """Move an edited source row to its place in the sorted rows of
+        cols and in the mask, return its position in the sorted rows of
+        each col"""
+        source = self.sourceModel()
+        positions = {}
+        for col in cols:
+            entry = self._sorted.get(col)
+            if entry is None:
+                continue
+            if entry[2] != source.sortKeysVersion(col):
+                del self._sorted[col]
+                continue
+            pos = np.flatnonzero(entry[0] == row)[0]
+            sortedRows = np.delete(entry[0], pos)
+            sortedKeys = np.delete(entry[1], pos)
+            key = source.sortKeys(col, [row])[0]
+            pos = np.searchsorted(sortedKeys, key, side="right")
+            entry[0] = np.insert(sortedRows, pos, row)
+            entry[1] = np.insert(sortedKeys, pos, key)
+            positions[col] = int(pos)
+        if self._mask is not None and LABEL_COLUMN in cols:
+            self._mask[row] = source.labelMask(self.filterLabel, [row])[0]
+        return positions
+
+    @Slot(QModelIndex, int, int)
+    def sourceRowsAboutToBeInserted(self, parent, first, last):
+        if self._order is None:
+            self.beginInsertRows(QModelIndex(), first, last)
+
+    @Slot(QModelIndex, int, int)
+    def sourceRowsInserted(self, parent, first, last):
+        if self._order is None:
+            self.endInsertRows()
+            return
+        if last > first:
+            # appended chunks, their rows are spread among the others
+            def remap(rows):
+                return rows + (last - first + 1) * (rows >= first)
+
+            def update():
+                self._insertSorted(first, last)
+                self._order, self._inverse = self._computeOrder()
+            self._relayout(update, remap)
+            return
+        self._insertSorted(first, last)
+        order, inverse = self._computeOrder()
+        row = int(inverse[first])
+        if row < 0:
+            self._order, self._inverse = order, inverse
+            return
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._order, self._inverse = order, inverse
+        self.endInsertRows()
+
+    @Slot(QModelIndex, int, int)
+    def sourceRowsAboutToBeRemoved(self, parent, first, last):
+        if self._order is None:
+            self.beginRemoveRows(QModelIndex(), first, last)
+
+    @Slot(QModelIndex, int, int)
+    def sourceRowsRemoved(self, parent, first, last):
+        if self._order is None:
+            self.endRemoveRows()
+            return
+        if last > first:
+            def remap(rows):
+                return np.where(
+                    rows < first, rows,
+                    np.where(rows > last, rows - (last - first + 1), -1))
+
+            def update():
+                self._removeSorted(first, last)
+                self._order, self._inverse = self._computeOrder()
+            self._relayout(update, remap)
+            return
+        row = int(self._inverse[first])
+        self._removeSorted(first, last)
+        order, inverse = self._computeOrder()
+        if row < 0:
+            self._order, self._inverse = order, inverse
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self._order, self._inverse = order, inverse
+        self.endRemoveRows()
+
+    def sourceDataChanged(self, topLeft, bottomRight, roles=()):
+        cols = range(topLeft.column(), bottomRight.column() + 1)
+        first, last = topLeft.row(), bottomRight.row()
+        if first == last:
+            if self._order is not None:
+                self._moveSourceRow(first, cols)
+            proxyRow = self.proxyRow(first)
+            if proxyRow >= 0:
+                self.dataChanged.emit(self.index(proxyRow, cols[0]),
+                                      self.index(proxyRow, cols[-1]), roles)
+            return
+        # columns read from the file, notified at once
+        if self._order is not None:
+            for col in cols:
+                self._sorted.pop(col, None)
+            if self.sortColumn in cols or \
+                    self._mask is not None and LABEL_COLUMN in cols:
+                self._relayout(self._updateOrder)
+            rows = self._inverse[first:last + 1]
+            rows = rows[rows >= 0]
+            first, last = (int(rows.min()), int(rows.max())) \
+                if rows.shape[0] > 0 else (0, -1)
+        if first <= last:
+            self.dataChanged.emit(self.index(first, cols[0]),
+                                  self.index(last, cols[-1]), roles)
+        if self._pendingSort is not None and self._pendingSort[0] in cols:
+            self.sort(*self._pendingSort)
+
+    def _moveSourceRow(self, row, cols):
+        """Follow the edit of a source row, which may move or hide it. Only
+        this row is moved in the order of the proxy rows."""
+        positions = self._updateSorted(row, cols)
+        if self.sortColumn not in cols and \
+                (self._mask is None or LABEL_COLUMN not in cols):
+            return
+        before = int(self._inverse[row])
+        if self.sortColumn >= 0 and self.sortColumn not in self._sorted:
+            # the sort keys changed, all rows are sorted again
+            self._relayout(self._updateOrder)
+            return
+        after = self._proxyPosition(row, before,
+                                    positions.get(self.sortColumn))
+        if before == after:
+            return
+        if before < 0:
+            self.beginInsertRows(QModelIndex(), after, after)
+            self._moveInOrder(row, before, after)
+            self.endInsertRows()
+        elif after < 0:
+            self.beginRemoveRows(QModelIndex(), before, before)
+            self._moveInOrder(row, before, after)
+            self.endRemoveRows()
+        else:
+            # the destination is counted before the row is taken out
+            self.beginMoveRows(QModelIndex(), before, before, QModelIndex(),
+                               after + 1 if after > before else after)
+            self._moveInOrder(row, before, after)
+            self.endMoveRows()
+
+    def _proxyPosition(self, row, before, pos=None):
+        """Proxy row of an edited source row, -1 if it is filtered out.
+        before is its current proxy row, pos its position in the sorted
+        rows of the sort column if known."""
+        if self._mask is not None and not self._mask[row]:
+            return -1
+        if self.sortColumn < 0:
+            return int(np.count_nonzero(self._mask[:row]))
+        sortedRows = self._sorted[self.sortColumn][0]
+        if pos is None:
+            pos = int(np.flatnonzero(sortedRows == row)[0])
+        if self._mask is None:
+            ascending = pos
+            count = sortedRows.shape[0]
+        else:
+            ascending = int(np.count_nonzero(self._mask[sortedRows[:pos]]))
+            count = self._order.shape[0] + (before < 0)
+        if self.sortOrder == Qt.DescendingOrder:
+            return count - 1 - ascending
+        return ascending
+
+    def _moveInOrder(self, row, before, after):
+        """Move a source row from proxy row before to after, -1 meaning
+        filtered out, updating the inverse of the rows in between"""
+        order = self._order
+        if before >= 0:
+            order = np.delete(order, before)
+            self._inverse[row] = -1
+        if after >= 0:
+            order = np.insert(order, after, row)
+        if before < 0 or after < 0:
+            first, last = max(before, after), order.shape[0] - 1
+        else:
+            first, last = min(before, after), max(before, after)
+        self._inverse[order[first:last + 1]] = np.arange(
+            first, last + 1, dtype=np.int64)
+        self._order = order
+
+    @Slot()
+    def sourceModelReset(self):
+        self._sorted = {}
+        if self.isActive():
+            self._updateOrder()
+        self.endResetModel()
@@ -0,0 +1,94 @@
+"""
+File: saver.py
+Description: Save datasets in background worker processes.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from PySide2.QtCore import QObject, Signal, Slot
+from pyqt_corrector.dataset import writeSnapshot
+
+
+class DatasetSaver(QObject):
+
+    """Save TableModels to disk in a pool of worker processes.
+    The GUI thread only copies the dataset into a snapshot, formatting and
+    writing the csv is done by the workers, which are processes since
+    pandas holds the GIL while writing csv files. Each file is written in a
+    temporary file renamed over the original one once complete.
+    A model is saved again only once its previous save is done, since its
+    columns not read yet are read from the file being replaced."""
+
+    saved = Signal(str)
+    failed = Signal(str)
+    # all saves are done, with the files which could not be saved
+    batchDone = Signal(list)
+    progress = Signal(str)
+    _done = Signal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.executor = None
+        self.jobs = {}
+        self.total = 0
+        self.finished = 0
+        self.failedFiles = []
+        # models to save again once their current save is done
+        self.queued = {}
+        # futures complete in a worker thread of the executor, go back to
+        # the GUI thread before touching models
+        self._done.connect(self.jobDone)
+
+    def save(self, filename, model):
+        if any(job[1] is model for job in self.jobs.values()):
+            self.queued[model] = filename
+            return
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context("spawn"))
+        if not self.jobs:
+            self.total = 0
+            self.finished = 0
+            self.failedFiles = []
+        future = self.executor.submit(writeSnapshot, filename,
+                                      model.snapshot())
+        self.jobs[future] = (filename, model, model.revision,
+                             model.ids())
+        self.total += 1
+        future.add_done_callback(self._done.emit)
+
+    def isSaving(self):
+        return bool(self.jobs)
+
+    @Slot(object)
+    def jobDone(self, future):
+        if future not in self.jobs:
+            # already handled by shutdown
+            return
+        filename, model, revision, keys = self.jobs.pop(future)
+        self.finished += 1
+        error = future.exception()
+        if error is not None:
+            self.failedFiles.append(filename)
+            self.failed.emit(f"{filename}: {error}")
+        else:
+            try:
+                model.setSaved(revision, future.result(), keys)
+            except RuntimeError:
+                # the tab was closed while saving
+                pass
+            self.saved.emit(filename)
+            self.progress.emit(f"Saved {self.finished}/{self.total}")
+        if model in self.queued:
+            self.save(self.queued.pop(model), model)
+        if not self.jobs:
+            self.batchDone.emit(self.failedFiles)
+
+    def shutdown(self):
+        # queued saves are only submitted once the previous ones are done
+        while self.jobs:
+            future = next(iter(self.jobs))
+            wait([future])
+            self.jobDone(future)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
@@ -5,40 +5,92 @@ Email: kwon-young.choi@hotmail.fr
 Date: 2019-08-05
 Description: Implement qt data models.
 """
-import pandas as pd
-from PySide2.QtCore import QModelIndex, QAbstractTableModel, Qt, QRectF
+import numpy as np
+from collections import OrderedDict
+from PySide2.QtCore import QModelIndex, QAbstractTableModel, Qt, QRectF, \
+    QSize, QTimer, Signal, Slot
+from PySide2.QtGui import QFont, QFontMetrics
+from pyqt_corrector.dataset import PageIndex, parseBox, formatBox, \
+    csvSignature
+from pyqt_corrector.loader import ColumnLoader
 
 
-def box2QRect(box):
-    x1, y1, x2, y2 = [int(coord) for coord in box.split("x")]
+# rows exposed to views at once, the other ones are fetched when the view
+# scrolls to them or when an index is asked for them
+FETCH_BATCH = 1000
+# formatted cells kept, enough for the rows shown by a view
+DISPLAY_CACHE_SIZE = 4096
+
+
+def displayFormatter(name):
+    """Function formatting the values of a column for display"""
+    if name == "box":
+        return formatBox
+    # str of a float32 score is its shortest repr, 0.9 and not 0.8999999761
+    return str
+
+
+def displayAlignment(name):
+    if name == "score":
+        return int(Qt.AlignRight | Qt.AlignVCenter)
+    return int(Qt.AlignLeft | Qt.AlignVCenter)
+
+
+def coords2QRect(coords):
+    x1, y1, x2, y2 = [int(coord) for coord in coords]
     width, height = x2 - x1, y2 - y1
     return QRectF(x1, y1, width, height)
 
 
-def QRectF2Box(rect):
-    [x1, y1, x2, y2] = [int(coor) for coor in [
+def QRectF2Coords(rect):
+    return [int(coor) for coor in [
         rect.left(), rect.top(), rect.right(), rect.bottom()]]
-    return f"{x1}x{y1}x{x2}x{y2}"
 
 
-def openDataset(filename):
-    dataset = pd.read_csv(
-        filename, header=0, skipinitialspace=True, skip_blank_lines=True,
-        comment="#")
-    for i, col in enumerate(["page", "label", "box"]):
-        assert dataset.columns[i] == col, \
-            f"{filename} does not have column {col} at index {i}"
-    return dataset
+def boxes2QRects(boxes):
+    """Batch version of coords2QRect over a Nx4 array"""
+    boxes = np.asarray(boxes, dtype=np.int32)
+    sizes = boxes[:, 2:] - boxes[:, :2]
+    return [QRectF(x1, y1, width, height) for (x1, y1), (width, height)
+            in zip(boxes[:, :2].tolist(), sizes.tolist())]
+
+
+def QRectFs2Boxes(rects):
+    """Batch version of QRectF2Coords returning a Nx4 int32 array"""
+    coords = np.array([
+        [rect.left(), rect.top(), rect.right(), rect.bottom()]
+        for rect in rects], dtype=np.float64).reshape(-1, 4)
+    return coords.astype(np.int32)
+
+
+def annotationId(index):
+    """ID of the annotation at an index of a TableModel, -1 for none"""
+    if not index.isValid():
+        return -1
+    return index.model().idAtRow(index.row())
+
+
+def box2QRect(box):
+    return coords2QRect(parseBox(box))
+
+
+def QRectF2Box(rect):
+    return formatBox(QRectF2Coords(rect))
 
 
 class TableModel(QAbstractTableModel):
 
     """Table Model"""
 
+    labelAdded = Signal(str)
+    labelRemoved = Signal(str)
+    # the source file was saved while columns were left in it
+    sourceChanged = Signal()
+
     def __init__(self, name, data, parent=None):
         """Constructor
 
-        :data: table data
+        :data: table data as a Dataset
         :parent: parent widget
 
         """
@@ -46,26 +98,89 @@ class TableModel(QAbstractTableModel):
 
         self._data = data
         self.name = name
+        # rows are inserted and deleted inside a gap buffer, close the gap
+        # once the user stops editing
+        self.compactTimer = QTimer(self)
+        self.compactTimer.setSingleShot(True)
+        self.compactTimer.setInterval(5000)
+        self.compactTimer.timeout.connect(self.compact)
+        # every edit bumps revision, savedRevision is the revision written
+        # on disk
+        self.revision = 0
+        self.savedRevision = 0
+        # False while rows are still being loaded in the background
+        self.complete = True
+        self.journal = None
+        # journal records are synced to disk at most a second after an edit,
+        # all at once
+        self.journalTimer = QTimer(self)
+        self.journalTimer.setSingleShot(True)
+        self.journalTimer.setInterval(1000)
+        self.journalTimer.timeout.connect(self.flushJournal)
+        # number of rows exposed to views
+        self.fetched = 0 if data is None else min(len(data), FETCH_BATCH)
+        # expose appended rows right away, for proxies needing all rows
+        self.fetchAll = False
+        # (row key, column) -> [text, size hint] of the most recently shown
+        # cells, the size hint being computed when first asked
+        self._displayCache = OrderedDict()
+        self._fontMetrics = None
+        if data is not None:
+            self._formatters = [displayFormatter(col) for col in data.columns]
+            self._alignments = [displayAlignment(col) for col in data.columns]
 
     def __str__(self):
-        return f"TableModel<{self.name}>: {self._data.shape}"
+        return f"TableModel<{self.name}>: {str(self._data)}"
 
     def rowCount(self, parent: QModelIndex):
-        """Get the number of rows"""
+        """Get the number of rows exposed to views"""
         if self._data is None:
             return 0
 
         if not parent.isValid():
-            return self._data.shape[0]
+            return self.fetched
         return 0
 
+    def totalRowCount(self):
+        """Get the number of rows of the dataset, fetched or not"""
+        if self._data is None:
+            return 0
+        return len(self._data)
+
+    def canFetchMore(self, parent: QModelIndex):
+        if self._data is None or parent.isValid():
+            return False
+        return self.fetched < len(self._data)
+
+    def fetchMore(self, parent: QModelIndex):
+        if self.canFetchMore(parent):
+            self.fetchUpTo(self.fetched)
+
+    def fetchUpTo(self, row):
+        """Expose rows up to row, and at least a batch of rows"""
+        last = min(max(row, self.fetched + FETCH_BATCH - 1),
+                   len(self._data) - 1)
+        if last < self.fetched:
+            return
+        self.beginInsertRows(QModelIndex(), self.fetched, last)
+        self.fetched = last + 1
+        self.endInsertRows()
+
+    def index(self, row, column, parent=QModelIndex()):
+        """Get the index of any row of the dataset, fetching it first if it
+        was not exposed yet"""
+        if self._data is not None and not parent.isValid() and \
+                self.fetched <= row < len(self._data):
+            self.fetchUpTo(row)
+        return super().index(row, column, parent)
+
     def columnCount(self, parent: QModelIndex):
         """Get the number of columns"""
         if self._data is None:
             return 0
 
         if not parent.isValid():
-            return self._data.shape[1]
+            return len(self._data.columns)
         return 0
 
     def data(self, index: QModelIndex, role):
@@ -77,16 +192,75 @@ class TableModel(QAbstractTableModel):
             return None
 
         if role == Qt.DisplayRole:
-            if index.column() == 3:
-                return float(self._data.iloc[index.row()][index.column()])
-            return self._data.iloc[index.row()][index.column()]
+            return self._displayEntry(index.row(), index.column())[0]
+        if role == Qt.TextAlignmentRole:
+            return self._alignments[index.column()]
+        if role == Qt.SizeHintRole:
+            return self._displaySize(index.row(), index.column())
         if role == Qt.UserRole:
-            page = self._data["page"][index.row()]
-            tableData = self._data.query(f"page == '{page}'").copy()
-            tableData["box"] = tableData["box"].apply(box2QRect)
-            return tableData
+            return self.pageData(self._data.get("page", index.row()))
         return None
 
+    def _displayEntry(self, row, col):
+        """Cached [text, size hint] of a cell"""
+        cacheKey = (self._data.key(row), col)
+        entry = self._displayCache.get(cacheKey)
+        if entry is not None:
+            self._displayCache.move_to_end(cacheKey)
+            return entry
+        name = self._data.columns[col]
+        if not self._data.isLoaded(name):
+            # shown once read by a ColumnLoader, never read while painting
+            return ["", None]
+        value = self._data.get(name, row)
+        entry = [self._formatters[col](value), None]
+        self._displayCache[cacheKey] = entry
+        if len(self._displayCache) > DISPLAY_CACHE_SIZE:
+            self._displayCache.popitem(last=False)
+        return entry
+
+    def _displaySize(self, row, col):
+        entry = self._displayEntry(row, col)
+        if entry[1] is None:
+            if self._fontMetrics is None:
+                self._fontMetrics = QFontMetrics(QFont())
+            entry[1] = QSize(
+                self._fontMetrics.horizontalAdvance(entry[0]) + 12,
+                self._fontMetrics.height() + 6)
+        return entry[1]
+
+    def _invalidateDisplay(self, row, col):
+        self._displayCache.pop((self._data.key(row), col), None)
+
+    def _invalidateRow(self, row):
+        """Forget the cells of a row being deleted or inserted, whose key
+        may have belonged to another row"""
+        key = self._data.key(row)
+        for col in range(len(self._data.columns)):
+            self._displayCache.pop((key, col), None)
+
+    def idAtRow(self, row):
+        """Stable ID of the annotation at row"""
+        return self._data.key(row)
+
+    def rowOfId(self, boxId):
+        """Row of the annotation with ID boxId, -1 if it was deleted"""
+        return self._data.keyRow(boxId)
+
+    def indexOfId(self, boxId, column):
+        row = self.rowOfId(boxId)
+        if row < 0:
+            return QModelIndex()
+        return self.index(row, column)
+
+    def ids(self):
+        """IDs of all rows"""
+        return self._data.keys()
+
+    def nextId(self):
+        """ID of the next appended annotation"""
+        return self._data.nextKey()
+
     def rowAtIndex(self, row):
         if not row >= 0:
             return None
@@ -94,7 +268,7 @@ class TableModel(QAbstractTableModel):
         if self._data is None:
             return None
 
-        return self._data.iloc[row]
+        return self._data.row(row)
 
     def pageAtIndex(self, index: QModelIndex):
         if not index.isValid():
@@ -103,7 +277,7 @@ class TableModel(QAbstractTableModel):
         if self._data is None:
             return None
 
-        return self._data["page"][index.row()]
+        return self._data.get("page", index.row())
 
     def boxAtIndex(self, index: QModelIndex):
         if not index.isValid():
@@ -112,7 +286,7 @@ class TableModel(QAbstractTableModel):
         if self._data is None:
             return None
 
-        return box2QRect(self._data["box"][index.row()])
+        return coords2QRect(self._data.get("box", index.row()))
 
     def labelAtIndex(self, index: QModelIndex):
         if not index.isValid():
@@ -121,15 +295,20 @@ class TableModel(QAbstractTableModel):
         if self._data is None:
             return None
 
-        return self._data["label"][index.row()]
-
+        return self._data.get("label", index.row())
 
     def pageData(self, page):
+        """List (ID, label, box) of all annotations in page"""
         if self._data is None:
             return None
-        tableData = self._data.query(f"page == '{page}'").copy()
-        tableData["box"] = tableData["box"].apply(box2QRect)
-        return tableData
+        rows = self._data.pageRows(page)
+        return list(zip(self._data.take("_key", rows).tolist(),
+                        self._data.take("label", rows),
+                        boxes2QRects(self._data.take("box", rows))))
+
+    def pageIndex(self):
+        """PageIndex of the dataset, to show its boxes once it is dropped"""
+        return PageIndex(self._data)
 
     def headerData(self, section, orientation, role):
         """Get header at given section"""
@@ -155,15 +334,21 @@ class TableModel(QAbstractTableModel):
             if index.column() == 0:
                 raise "First column of dataset is not editable"
             if index.column() == 1:
-                self._data.iloc[index.row(), index.column()] = value
-                assert self._data.iloc[index.row()][index.column()] == value
-                self.dataChanged.emit(index, index, role)
+                previous = self._data.get("label", index.row())
+                self._data.setLabel(index.row(), value)
+                self._invalidateDisplay(index.row(), index.column())
+                self.record({"op": "label", "row": index.row(),
+                             "label": value})
+                self.dataChanged.emit(
+                    index, index, [Qt.DisplayRole, Qt.EditRole])
+                self.labelsChanged(previous, value)
             if index.column() == 2:
-                self._data.iloc[index.row(), index.column()] = QRectF2Box(
-                    value)
-                assert self._data.iloc[index.row()][index.column()] == \
-                    QRectF2Box(value)
-                self.dataChanged.emit(index, index, role)
+                coords = QRectF2Coords(value)
+                self._data.setBox(index.row(), coords)
+                self._invalidateDisplay(index.row(), index.column())
+                self.record({"op": "box", "row": index.row(), "box": coords})
+                self.dataChanged.emit(
+                    index, index, [Qt.DisplayRole, Qt.EditRole])
                 return True
         return False
 
@@ -171,52 +356,202 @@ class TableModel(QAbstractTableModel):
         index = self.index(row, 1)
         return self.setData(index, label, Qt.EditRole)
 
-    def makeRowData(self, page, label, box):
-        if self.columnCount(QModelIndex()) == 4 and 'score' == self._data.columns[3]:
-            return pd.Series([page, label, QRectF2Box(box), 0],
-                             index=self._data.columns)
-        elif self.columnCount(QModelIndex()) == 3:
-            return pd.Series([page, label, QRectF2Box(box)],
-                             index=self._data.columns)
-        else:
-            raise "Invalid Number of Columns"
+    def makeRowData(self, page, label, box, boxId=None):
+        rowData = {"page": page, "label": label, "box": QRectF2Coords(box)}
+        if self._data.hasScore():
+            rowData["score"] = 0
+        if boxId is not None:
+            rowData["_id"] = boxId
+        return rowData
 
     def appendRow(self, rowData):
         if self._data is None:
             return False
 
-        self._data = self._data.append(rowData, ignore_index=True)
-        self._data = self._data.reset_index(drop=True)
-        topLeft = self.index(self.rowCount(QModelIndex()), 0)
-        bottomRight = self.index(self.rowCount(QModelIndex()),
-                                 self.columnCount(QModelIndex()))
-        self.layoutChanged.emit()
-        self.dataChanged.emit(topLeft, bottomRight, Qt.EditRole)
+        row = len(self._data)
+        notified = self._beginInsertRows(row)
+        self._data.append(rowData)
+        self._invalidateRow(row)
+        self._endInsertRows(notified)
+        # appended rows are recorded as inserted at their row, so that the
+        # journal stays valid when chunks are appended afterwards
+        self.record({"op": "insert", "row": row, "data": rowData})
+        self.labelsChanged(None, rowData["label"])
         return True
 
+    @Slot(object)
+    def appendDataset(self, dataset):
+        """Append all rows of a Dataset, like a chunk of a file being
+        loaded"""
+        if self._data is None or len(dataset) == 0:
+            return
+
+        labels = self._data.labelSet()
+        # new rows are fetched by views when they scroll to them
+        self._data.extend(dataset)
+        if self.fetchAll:
+            self.fetchUpTo(len(self._data) - 1)
+        elif self.fetched < FETCH_BATCH:
+            self.fetchUpTo(FETCH_BATCH - 1)
+        for label in dataset.labelSet() - labels:
+            self.labelAdded.emit(label)
+
     def deleteRow(self, row):
         if self._data is None:
             return False
 
-        self._data = self._data.drop(row)
-        self._data = self._data.reset_index(drop=True)
-        topLeft = self.index(row, 0)
-        bottomRight = self.index(row, self.columnCount(QModelIndex()))
-        self.layoutChanged.emit()
-        self.dataChanged.emit(topLeft, bottomRight, Qt.EditRole)
+        label = self._data.get("label", row)
+        self._invalidateRow(row)
+        notified = row < self.fetched
+        if notified:
+            self.beginRemoveRows(QModelIndex(), row, row)
+        self._data.delete(row)
+        if notified:
+            self.fetched -= 1
+            self.endRemoveRows()
+        self.record({"op": "delete", "row": row})
+        self.compactTimer.start()
+        self.labelsChanged(label, None)
         return True
 
     def insertRow(self, row, rowData):
-        dfA = self._data.iloc[:row]
-        dfB = self._data.iloc[row:]
-        self._data = dfA.append(rowData).append(dfB).reset_index(drop=True)
-        topLeft = self.index(row, 0)
-        bottomRight = self.index(row, self.columnCount(QModelIndex()))
-        self.layoutChanged.emit()
-        self.dataChanged.emit(topLeft, bottomRight, Qt.EditRole)
+        notified = self._beginInsertRows(row)
+        self._data.insert(row, rowData)
+        self._invalidateRow(row)
+        self._endInsertRows(notified)
+        self.record({"op": "insert", "row": row, "data": rowData})
+        self.compactTimer.start()
+        self.labelsChanged(None, rowData["label"])
+
+    def _beginInsertRows(self, row):
+        """Notify views of a row insertion if it is among the exposed rows,
+        or right after them once all rows are exposed"""
+        if row < self.fetched or self.fetched == len(self._data):
+            self.beginInsertRows(QModelIndex(), row, row)
+            return True
+        return False
+
+    def _endInsertRows(self, notified):
+        if notified:
+            self.fetched += 1
+            self.endInsertRows()
+
+    def labelsChanged(self, previous, label):
+        """Notify labels appearing or disappearing from the dataset after one
+        row label went from previous to label, None meaning no row"""
+        if previous == label:
+            return
+        if previous is not None and self._data.labelCount(previous) == 0:
+            self.labelRemoved.emit(previous)
+        if label is not None and self._data.labelCount(label) == 1:
+            self.labelAdded.emit(label)
+
+    def compact(self):
+        if self._data is not None:
+            self._data.compact()
 
     def labelSet(self):
-        return set(self._data["label"].unique())
+        return self._data.labelSet()
+
+    def isColumnLoaded(self, col):
+        """Whether a column was read, the other ones are read from the file
+        in the background and given to setColumns"""
+        return self._data.isLoaded(self._data.columns[col])
+
+    def columnLoader(self, parent=None):
+        """ColumnLoader filling the columns left in the source file, None if
+        there is none"""
+        if self._data is None or self._data.source is None or \
+                not self._data.lazyColumns():
+            return None
+        loader = ColumnLoader(self._data.source, self._data.lazyColumns(),
+                              self._data.sourceSignature, parent)
+        loader.columnsLoaded.connect(self.setColumns)
+        return loader
+
+    @Slot(list, object, object)
+    def setColumns(self, names, values, signature):
+        """Fill columns read from the file with signature by a ColumnLoader,
+        unless the file was saved since, another ColumnLoader reading them
+        from the saved file"""
+        if self._data is None or signature != self._data.sourceSignature:
+            return
+        names = [name for name in names if not self._data.isLoaded(name)]
+        self._data.setColumns(names, values)
+        if self.fetched == 0:
+            return
+        for name in names:
+            col = self._data.columns.index(name)
+            self.dataChanged.emit(self.index(0, col),
+                                  self.index(self.fetched - 1, col),
+                                  [Qt.DisplayRole])
+
+    def sortKeys(self, col, rows=None):
+        """Keys ordering all rows, or rows, by a column"""
+        return self._data.sortKeys(self._data.columns[col], rows)
+
+    def sortKeysVersion(self, col):
+        """Keys of different versions must not be compared"""
+        return self._data.sortKeysVersion(self._data.columns[col])
+
+    def labelMask(self, label, rows=None):
+        return self._data.labelMask(label, rows)
+
+    def nbytes(self):
+        if self._data is None:
+            return 0
+        return self._data.nbytes()
+
+    def isEvictable(self):
+        """Whether the dataset can be dropped and read again from disk"""
+        return self.complete and not self.isModified()
+
+    def setJournal(self, journal):
+        """Record edits in journal, which may hold edits replayed onto the
+        dataset and not saved yet"""
+        self.journal = journal
+        self.revision = journal.revision
+        self.savedRevision = journal.base
+
+    def record(self, record):
+        """Count an edit of the dataset and append it to the journal"""
+        if self.journal is None:
+            self.revision += 1
+        else:
+            self.revision = self.journal.append(record)
+            if not self.journalTimer.isActive():
+                self.journalTimer.start()
+
+    @Slot()
+    def flushJournal(self):
+        """Write pending journal records"""
+        if self.journal is not None:
+            self.journal.flush()
+
+    def isModified(self):
+        return self.revision != self.savedRevision
+
+    def snapshot(self):
+        """Copy of the dataset that can be saved outside of the GUI thread"""
+        return self._data.snapshot()
+
+    @Slot()
+    def setComplete(self):
+        self.complete = True
+
+    def setSaved(self, revision, signature, keys=None):
+        """The dataset at revision was saved in a file with signature, its
+        rows with keys in this order when given"""
+        self.savedRevision = revision
+        if self.journal is not None:
+            self.journal.saved(revision, signature)
+        if keys is not None:
+            # columns not read yet are now read from the saved file
+            self._data.rebase(keys, signature)
+            if self._data.lazyColumns():
+                self.sourceChanged.emit()
 
     def save(self, name):
-        self._data.to_csv(name, index=False)
+        keys = self.ids()
+        self._data.save(name)
+        self.setSaved(self.revision, csvSignature(name), keys)
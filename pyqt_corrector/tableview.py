@@ -1,11 +1,68 @@
-from PySide2.QtWidgets import QTableView
-from PySide2.QtCore import Signal, QItemSelection, QModelIndex
+from PySide2.QtWidgets import QTableView, QHeaderView
+from PySide2.QtCore import Signal, QItemSelection, QModelIndex, Qt
+from pyqt_corrector.proxymodel import SortFilterProxyModel
+
+# rows measured when sizing a column to its contents
+SIZE_SAMPLE_ROWS = 100
 
 
 class TableView(QTableView):
 
     setCurrentIndexSignal = Signal(QModelIndex)
 
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # measure a bounded sample of rows when sizing columns, and give all
+        # rows the same height so that no row is measured on its own
+        self.setResizeContentsPrecision(SIZE_SAMPLE_ROWS)
+        header = self.verticalHeader()
+        header.setSectionResizeMode(QHeaderView.Fixed)
+        header.setDefaultSectionSize(self.fontMetrics().height() + 6)
+
     def setCurrentIndex(self, index):
         self.setCurrentIndexSignal.emit(index)
         super().setCurrentIndex(index)
+
+    def setSourceModel(self, model):
+        """Show a TableModel through a SortFilterProxyModel, sorted by
+        clicking on the column headers"""
+        proxy = SortFilterProxyModel(self)
+        proxy.setSourceModel(model)
+        self.setModel(proxy)
+        # rows keep the order of the file until a header is clicked
+        self.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.setSortingEnabled(True)
+
+    def sourceModel(self):
+        return self.model().sourceModel()
+
+    def mapToSource(self, index):
+        """Index of the TableModel shown at an index of the view"""
+        return self.model().mapToSource(index)
+
+    def mapFromSource(self, index):
+        """Index of the view showing an index of the TableModel, invalid if
+        it is filtered out"""
+        return self.model().mapFromSource(index)
+
+    def setLabelFilter(self, label):
+        """Only show rows with label, None showing all rows"""
+        self.model().setFilterLabel(label)
+
+    def clearSortFilter(self):
+        """Show all rows in the order of the file"""
+        self.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.model().sort(-1)
+        self.model().setFilterLabel(None)
+
+    def resizeLoadedColumnsToContents(self):
+        """Size the columns already read from the file to their contents
+        and return the width needed to show all columns"""
+        model = self.sourceModel()
+        width = self.verticalHeader().width() + 20
+        for col in range(model.columnCount(QModelIndex())):
+            # sizing the other columns would read them from the file
+            if model.isColumnLoaded(col):
+                self.resizeColumnToContents(col)
+            width += self.columnWidth(col)
+        return width
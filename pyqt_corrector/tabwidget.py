@@ -1,26 +1,81 @@
+from collections import Counter
 import matplotlib as mpl
 from PySide2.QtWidgets import QTabWidget, QWidget
-from PySide2.QtCore import QModelIndex, Signal, Slot
+from PySide2.QtCore import QModelIndex, QTimer, Signal, Slot
 from PySide2.QtGui import QColor
+from pyqt_corrector.tablemodel import boxes2QRects
 
 
 class Tab(QWidget):
 
-    def __init__(self, filename, parent=None):
+    """Tab holding the TableView of a dataset.
+    A placeholder tab only knows the filename of its dataset, its view and
+    model are made by calling builder with the tab the first time they are
+    needed. lazy placeholders were never read, evicted ones were dropped to
+    save memory and remember their labels and the boxes of each page."""
+
+    def __init__(self, filename, parent=None, builder=None, lazy=False):
         super().__init__(parent)
 
         self.filename = filename
+        self.view = None
+        self.builder = builder
+        self.lazy = lazy
+        self.evicted = False
+        self.labels = set()
+        # IDs of the rows of an evicted dataset, given back when it is read
+        # again
+        self.keys = None
+        # PageIndex of an evicted dataset
+        self.pageIndex = None
+        self.lastUsed = 0
+
+    def isMaterialized(self):
+        return self.view is not None
+
+    def materialize(self):
+        if self.view is None and self.builder is not None:
+            self.builder(self)
+            self.evicted = False
+            self.keys = None
+            self.pageIndex = None
+        return self.view
+
+    def evict(self):
+        """Drop the view and model, they are made again by builder"""
+        self.labels = self.model().labelSet()
+        self.keys = self.model().ids()
+        self.pageIndex = self.model().pageIndex()
+        view, self.view = self.view, None
+        self.layout().removeWidget(view)
+        view.deleteLater()
+        self.evicted = True
+
+    def model(self):
+        if self.view is None:
+            return None
+        return self.view.sourceModel()
 
 
 class TabWidget(QTabWidget):
 
     cellClickedSignal = Signal(int, QModelIndex, int, QModelIndex)
+    tabMaterialized = Signal(int)
 
     def __init__(self, parent=None):
         super().__init__(parent)
 
         self.previousCellIndex = QModelIndex()
         self.previousTabIndex = -1
+        # label -> number of tabs containing it
+        self._labelCounts = Counter()
+        self._labelModels = set()
+        self._colorMaps = None
+        # budget in bytes of the datasets kept in memory, None for no limit
+        self.memoryBudget = None
+        self._useCount = 0
+        self.currentChanged.connect(self.invalidateColorMaps)
+        self.currentChanged.connect(self.materializeCurrentTab)
 
     def filename(self, index=-1):
         if index == -1:
@@ -34,48 +89,208 @@ class TabWidget(QTabWidget):
             yield self.widget(i).filename
 
     def getCurrentTableView(self):
-        return self.currentWidget().children()[1]
+        return self.getTableView(self.currentIndex())
 
     def getCurrentSelectedCell(self):
+        """Index of the TableModel selected in the current view"""
         if self.count() > 0:
-            return self.getCurrentTableView().currentIndex()
+            view = self.getCurrentTableView()
+            return view.mapToSource(view.currentIndex())
 
         return QModelIndex()
 
     def setCurrentSelectedCell(self, index):
         if index.isValid():
-            self.getCurrentTableView().setCurrentIndex(index)
+            view = self.getCurrentTableView()
+            view.setCurrentIndex(view.mapFromSource(index))
 
     def getTableModel(self, index):
-        return self.widget(index).children()[1].model()
+        return self.getTableView(index).sourceModel()
 
     def getTableView(self, index):
-        return self.widget(index).children()[1]
+        return self._materialize(index, True).view
+
+    def _materialize(self, index, notify):
+        tab = self.widget(index)
+        self._useCount += 1
+        tab.lastUsed = self._useCount
+        if not tab.isMaterialized():
+            # boxes of evicted tabs are still shown
+            notify = notify and not tab.evicted
+            tab.materialize()
+            self.rebuildLabelRegistry()
+            if notify:
+                self.tabMaterialized.emit(index)
+            self.scheduleEviction()
+        return tab
+
+    @Slot()
+    def materializeCurrentTab(self):
+        # wait for the end of the current operation, which may be removing
+        # many tabs, so that only the tab finally shown is read
+        QTimer.singleShot(0, self._materializeCurrentTab)
+
+    def _materializeCurrentTab(self):
+        if self.count() > 0:
+            self.getTableView(self.currentIndex())
+        self.scheduleEviction()
+
+    def setMemoryBudget(self, budget):
+        self.memoryBudget = budget
+        self.scheduleEviction()
+
+    def residentSize(self, index):
+        """Bytes used by the dataset of a tab, 0 for placeholders"""
+        model = self.widget(index).model()
+        if model is None:
+            return 0
+        return model.nbytes()
+
+    def scheduleEviction(self):
+        # never evict a model in the middle of an operation using it
+        QTimer.singleShot(0, self.enforceMemoryBudget)
+
+    @Slot()
+    def enforceMemoryBudget(self):
+        """Evict the least recently used datasets that can be read again
+        from disk until the others fit in the memory budget"""
+        sizes = [self.residentSize(i) for i in range(self.count())]
+        for i, size in enumerate(sizes):
+            self.setTabToolTip(
+                i, f"{self.widget(i).filename}\n"
+                   f"{size / 2 ** 20:.1f} MiB in memory")
+        if self.memoryBudget is None:
+            return
+        total = sum(sizes)
+        tabs = sorted((self.widget(i) for i in range(self.count())),
+                      key=lambda tab: tab.lastUsed)
+        evicted = False
+        for tab in tabs:
+            if total <= self.memoryBudget:
+                break
+            if not tab.isMaterialized() or tab is self.currentWidget() or \
+                    tab.builder is None or not tab.model().isEvictable():
+                continue
+            index = self.indexOf(tab)
+            total -= sizes[index]
+            if index == self.previousTabIndex or \
+                    self.previousCellIndex.model() is tab.model():
+                # the model is deleted with the view
+                self.previousCellIndex = QModelIndex()
+                self.previousTabIndex = -1
+            tab.evict()
+            self.setTabToolTip(index, f"{tab.filename}\n0.0 MiB in memory")
+            evicted = True
+        if evicted:
+            self.rebuildLabelRegistry()
 
     def getCurrentTableModel(self):
-        return self.getCurrentTableView().model()
+        return self.getCurrentTableView().sourceModel()
+
+    def shownRowCount(self):
+        """Number of rows of the current view, fetched or not"""
+        proxy = self.getCurrentTableView().model()
+        if proxy.isActive():
+            return proxy.rowCount()
+        return proxy.sourceModel().totalRowCount()
+
+    def stepRow(self, row, step):
+        """Row of the TableModel step rows after row in the order of the
+        current view, wrapping around, -1 if no row is shown"""
+        rowCount = self.shownRowCount()
+        if rowCount == 0:
+            return -1
+        proxy = self.getCurrentTableView().model()
+        if not proxy.isActive():
+            return (row + step) % rowCount
+        row = proxy.proxyRow(row) if row >= 0 else -1
+        return proxy.sourceRow((row + step) % rowCount)
 
     def models(self):
+        """Models of all tabs, None for placeholder tabs"""
         for i in range(self.count()):
-            yield self.getTableModel(i)
+            yield self.widget(i).model()
 
     def views(self):
+        """Views of all tabs, None for placeholder tabs"""
         for i in range(self.count()):
-            yield self.getTableView(i)
+            yield self.widget(i).view
 
     def labelSet(self, index=-1):
         if index >= 0:
-            return self.getTableModel(index).labelSet()
+            model = self.widget(index).model()
+            if model is None:
+                return set(self.widget(index).labels)
+            return model.labelSet()
+
+        return set(self._labelCounts)
+
+    def tabInserted(self, index):
+        super().tabInserted(index)
+        self.rebuildLabelRegistry()
+
+    def tabRemoved(self, index):
+        super().tabRemoved(index)
+        self.rebuildLabelRegistry()
+
+    def rebuildLabelRegistry(self):
+        """Merge label sets of all tabs and follow label changes of their
+        models"""
+        models = set(self.models()) - {None}
+        for model in self._labelModels - models:
+            model.labelAdded.disconnect(self.labelAdded)
+            model.labelRemoved.disconnect(self.labelRemoved)
+        for model in models - self._labelModels:
+            model.labelAdded.connect(self.labelAdded)
+            model.labelRemoved.connect(self.labelRemoved)
+        self._labelModels = models
+        self._labelCounts = Counter()
+        for i in range(self.count()):
+            self._labelCounts.update(self.labelSet(i))
+        self.invalidateColorMaps()
+
+    @Slot(str)
+    def labelAdded(self, label):
+        self._labelCounts[label] += 1
+        if self._labelCounts[label] == 1:
+            self.invalidateColorMaps()
 
-        labels = set()
-        for model in self.models():
-            labels |= model.labelSet()
-        return labels
+    @Slot(str)
+    def labelRemoved(self, label):
+        self._labelCounts[label] -= 1
+        if self._labelCounts[label] <= 0:
+            del self._labelCounts[label]
+            self.invalidateColorMaps()
+
+    @Slot()
+    def invalidateColorMaps(self):
+        self._colorMaps = None
 
     def pageDatas(self, page):
-        return [model.pageData(page) for model in self.models()]
+        """pageData of each tab. Boxes of evicted tabs come from their
+        PageIndex, tabs never read have no box."""
+        pageDatas = []
+        for i in range(self.count()):
+            tab = self.widget(i)
+            model = tab.model()
+            if model is not None:
+                pageDatas.append(model.pageData(page))
+            elif tab.pageIndex is not None:
+                keys, labels, boxes = tab.pageIndex.page(page)
+                pageDatas.append(list(zip(keys.tolist(), labels,
+                                          boxes2QRects(boxes))))
+            else:
+                pageDatas.append([])
+        return pageDatas
 
     def color_map(self, tabIndex):
+        if self._colorMaps is None:
+            self._colorMaps = self.computeColorMaps()
+        if 0 <= tabIndex < len(self._colorMaps):
+            return self._colorMaps[tabIndex]
+        return None
+
+    def computeColorMaps(self):
         labels = list(self.labelSet())
         labels.sort()
         num_colors = len(labels) + self.count() - 1
@@ -84,6 +299,7 @@ class TabWidget(QTabWidget):
             for i, x in zip(range(num_colors),
                             mpl.rcParams["axes.prop_cycle"])]
         curIndex = self.currentIndex()
+        color_maps = []
         for i in range(self.count()):
             if i == curIndex:
                 color_map = {
@@ -91,20 +307,21 @@ class TabWidget(QTabWidget):
             else:
                 num_colors -= 1
                 color_map = {label: colors[num_colors] for label in labels}
-            if i == tabIndex:
-                return color_map
-        return None
+            color_maps.append(color_map)
+        return color_maps
 
     def getTableViewIndex(self, view):
         return [v for v in self.views()].index(view)
 
     @Slot(QModelIndex)
     def cellIndexChanged(self, index: QModelIndex):
-        self.previousCellIndex = index
+        self.previousCellIndex = self.sender().mapToSource(index)
 
     @Slot(QModelIndex)
     def cellClicked(self, index: QModelIndex):
-        tabIndex = self.getTableViewIndex(self.sender())
+        view = self.sender()
+        tabIndex = self.getTableViewIndex(view)
+        index = view.mapToSource(index)
         self.cellClickedSignal.emit(
             tabIndex, index, self.previousTabIndex, self.previousCellIndex)
         self.previousCellIndex = index
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `pyqt_corrector.dataset`."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyqt_corrector.dataset import Dataset, CacheWriter, saveCache, \
+    loadCache, csvSignature, cachePath, readCsv, readCsvHeader, \
+    readCsvChunks, PageIndex, READ_ERRORS
+
+
+def rowData(page, label, box, **extra):
+    return dict({"page": page, "label": label, "box": box}, **extra)
+
+
+@pytest.fixture
+def dataset():
+    df = pd.DataFrame({
+        "page": ["p0", "p1", "p0", "p2", "p1"],
+        "label": ["a", "b", "a", "c", "a"],
+        "box": ["0x0x10x10", "1x1x11x11", "2x2x12x12", "3x3x13x13",
+                "4x4x14x14"],
+        "score": [0.5, 0.6, 0.7, 0.8, 0.9]})
+    return Dataset.fromDataFrame(df)
+
+
+@pytest.fixture
+def csvFile(tmp_path):
+    filename = str(tmp_path / "dataset.csv")
+    with open(filename, "w") as file:
+        file.write("page,label,box,score,comment\n")
+        for i in range(50):
+            file.write(f"p{i % 4},l{i % 3},{i}x{i}x{i + 5}x{i + 5},"
+                       f"{i / 100},note {i}\n")
+    return filename
+
+
+def labels(dataset):
+    return [dataset.get("label", row) for row in range(len(dataset))]
+
+
+def test_insert_delete_keep_row_order(dataset):
+    dataset.insert(1, rowData("p3", "x", (5, 5, 6, 6)))
+    dataset.insert(4, rowData("p3", "y", (6, 6, 7, 7)))
+    dataset.delete(0)
+    dataset.append(rowData("p0", "z", (7, 7, 8, 8)))
+    assert labels(dataset) == ["x", "b", "a", "y", "c", "a", "z"]
+    dataset.compact()
+    assert labels(dataset) == ["x", "b", "a", "y", "c", "a", "z"]
+    assert dataset.get("box", 6).tolist() == [7, 7, 8, 8]
+
+
+def test_many_appends_grow_the_gap(dataset):
+    for i in range(100):
+        dataset.append(rowData(f"p{i % 3}", "n", (i, i, i + 1, i + 1)))
+    assert len(dataset) == 105
+    assert dataset.get("box", 104).tolist() == [99, 99, 100, 100]
+    assert dataset.capacity() >= len(dataset)
+
+
+def test_keys_are_stable(dataset):
+    key = dataset.key(3)
+    dataset.insert(0, rowData("p0", "x", (0, 0, 1, 1)))
+    dataset.delete(2)
+    assert dataset.keyRow(key) == 3
+    assert dataset.key(3) == key
+    dataset.delete(3)
+    assert dataset.keyRow(key) == -1
+
+
+def test_deleted_key_is_reused_on_reinsert(dataset):
+    row = dataset.row(2)
+    dataset.delete(2)
+    nextKey = dataset.nextKey()
+    dataset.insert(2, row)
+    assert dataset.key(2) == row["_id"]
+    assert dataset.nextKey() == nextKey
+
+
+def test_used_key_is_not_reused(dataset):
+    dataset.append(rowData("p0", "x", (0, 0, 1, 1), _id=dataset.key(0)))
+    assert dataset.key(5) == 5
+    assert len(set(dataset.keys().tolist())) == 6
+
+
+def test_unknown_key_is_not_reserved(dataset):
+    dataset.append(rowData("p0", "x", (0, 0, 1, 1), _id=1000000))
+    assert dataset.key(5) == 5
+    assert dataset.nextKey() == 6
+
+
+def test_set_keys(dataset):
+    keys = np.array([7, 3, 9, 0, 1])
+    dataset.setKeys(keys)
+    assert dataset.keys().tolist() == keys.tolist()
+    assert dataset.keyRow(9) == 2
+    assert dataset.keyRow(4) == -1
+    assert dataset.nextKey() == 10
+    assert sorted(dataset.pageRows("p0").tolist()) == [0, 2]
+
+
+def test_set_keys_does_not_lower_next_key(dataset):
+    dataset.append(rowData("p2", "x", (0, 0, 1, 1)))
+    dataset.append(rowData("p2", "x", (0, 0, 1, 1)))
+    assert dataset.nextKey() == 7
+    dataset.setKeys(np.arange(7))
+    dataset.delete(6)
+    dataset.setKeys(np.arange(6))
+    assert dataset.nextKey() == 7
+    dataset.append(rowData("p2", "y", (0, 0, 1, 1)))
+    assert dataset.key(6) == 7
+
+
+def test_page_index_follows_edits(dataset):
+    assert dataset.pageRows("p0").tolist() == [0, 2]
+    dataset.insert(0, rowData("p0", "x", (0, 0, 1, 1)))
+    assert dataset.pageRows("p0").tolist() == [0, 1, 3]
+    dataset.delete(3)
+    assert dataset.pageRows("p0").tolist() == [0, 1]
+    dataset.delete(3)
+    assert "p2" not in dataset.pageSet()
+    assert dataset.pageRows("unknown").tolist() == []
+
+
+def test_label_counts(dataset):
+    assert dataset.labelCount("a") == 3
+    dataset.setLabel(0, "c")
+    assert dataset.labelCount("a") == 2
+    assert dataset.labelCount("c") == 2
+    dataset.delete(3)
+    dataset.delete(0)
+    assert dataset.labelSet() == {"a", "b"}
+    dataset.append(rowData("p0", "d", (0, 0, 1, 1)))
+    assert dataset.labelCount("d") == 1
+
+
+def test_extend(dataset):
+    other = Dataset.fromDataFrame(pd.DataFrame({
+        "page": ["p0", "p4"], "label": ["e", "a"],
+        "box": ["0x0x1x1", "1x1x2x2"], "score": [0.1, 0.2]}))
+    dataset.delete(0)
+    dataset.extend(other)
+    assert labels(dataset) == ["b", "a", "c", "a", "e", "a"]
+    assert dataset.pageRows("p0").tolist() == [1, 4]
+    assert dataset.pageRows("p4").tolist() == [5]
+    assert dataset.labelCount("a") == 3
+    assert len(set(dataset.keys().tolist())) == 6
+
+
+def test_cache_round_trip(csvFile):
+    df = readCsv(csvFile)
+    dataset = Dataset.fromDataFrame(df[["page", "label", "box", "score"]],
+                                    df.columns, csvFile)
+    saveCache(csvFile, dataset.snapshot(), csvSignature(csvFile))
+    cached = loadCache(csvFile)
+    assert cached is not None
+    assert cached.columns == dataset.columns
+    for col in ["page", "label", "box", "score"]:
+        assert np.array_equal(cached.column(col), dataset.column(col))
+    assert cached.get("comment", 7) == "note 7"
+
+
+def test_stale_cache_is_ignored(csvFile):
+    dataset = Dataset.fromDataFrame(readCsv(csvFile))
+    saveCache(csvFile, dataset.snapshot(), [0, 0])
+    assert loadCache(csvFile) is None
+
+
+def test_corrupt_cache_is_ignored(csvFile):
+    with open(cachePath(csvFile), "wb") as file:
+        file.write(b"garbage")
+    assert loadCache(csvFile) is None
+
+
+def test_save_keeps_lazy_columns(csvFile, tmp_path):
+    df = readCsv(csvFile)
+    dataset = Dataset.fromDataFrame(df[["page", "label", "box", "score"]],
+                                    df.columns, csvFile)
+    dataset.delete(0)
+    dataset.setLabel(0, "new")
+    output = str(tmp_path / "saved.csv")
+    dataset.save(output)
+    saved = readCsv(output)
+    assert len(saved) == 49
+    assert saved["label"][0] == "new"
+    assert saved["comment"][0] == "note 1"
+
+
+def test_cache_of_extra_columns(csvFile):
+    dataset = Dataset.fromDataFrame(readCsv(csvFile))
+    saveCache(csvFile, dataset.snapshot(), csvSignature(csvFile))
+    cached = loadCache(csvFile)
+    assert cached.isLoaded("comment")
+    assert cached.column("comment").tolist() == \
+        dataset.column("comment").tolist()
+
+
+def test_cache_writer_by_chunks(csvFile):
+    columns = readCsvHeader(csvFile)
+    writer = CacheWriter(csvFile, columns, csvSignature(csvFile))
+    whole = None
+    for chunk in readCsvChunks(csvFile, columns, 7, 20):
+        dataset = Dataset.fromDataFrame(chunk, columns, csvFile)
+        writer.append(dataset)
+        if whole is None:
+            whole = dataset
+        else:
+            whole.extend(dataset)
+    writer.close()
+    assert writer.files == {}
+    cached = loadCache(csvFile)
+    assert len(cached) == 50
+    for col in ["page", "label", "box", "score", "_source"]:
+        assert np.array_equal(cached.column(col), whole.column(col))
+    assert not cached.isLoaded("comment")
+    assert cached.get("comment", 49) == "note 49"
+
+
+def test_set_keys_of_rows_still_to_load(dataset):
+    other = Dataset.fromDataFrame(pd.DataFrame({
+        "page": ["p0", "p4", "p1"], "label": ["e", "a", "b"],
+        "box": ["0x0x1x1", "1x1x2x2", "2x2x3x3"],
+        "score": [0.1, 0.2, 0.3]}))
+    dataset.setKeys(np.array([9, 2, 8, 0, 5, 1, 4]))
+    assert dataset.nextKey() == 10
+    dataset.extend(other)
+    assert dataset.keys().tolist() == [9, 2, 8, 0, 5, 1, 4, 10]
+    assert dataset.keyRow(4) == 6
+    assert dataset.pageRows("p0").tolist() == [0, 2, 5]
+    assert dataset.pageRows("p1").tolist() == [1, 4, 7]
+    dataset.append(rowData("p0", "x", (0, 0, 1, 1)))
+    assert dataset.key(8) == 11
+
+
+def test_page_index(dataset):
+    dataset.delete(0)
+    dataset.insert(2, rowData("p0", "x", (5, 5, 6, 6)))
+    index = PageIndex(dataset)
+    keys, labels, boxes = index.page("p0")
+    assert keys.tolist() == [dataset.key(row) for row in
+                             dataset.pageRows("p0")]
+    assert labels.tolist() == ["a", "x"]
+    assert boxes.tolist() == [[2, 2, 12, 12], [5, 5, 6, 6]]
+    assert index.page("unknown")[0].tolist() == []
+
+
+def test_chunks_carry_all_columns(csvFile):
+    columns = readCsvHeader(csvFile)
+    chunks = readCsvChunks(csvFile, columns, 7, 20)
+    whole = Dataset.fromDataFrame(next(chunks), columns, csvFile)
+    for chunk in chunks:
+        whole.extend(Dataset.fromDataFrame(chunk, columns, csvFile))
+    assert whole.lazyColumns() == []
+    assert whole.get("comment", 49) == "note 49"
+    assert whole.get("score", 49) == np.float32(0.49)
+
+
+def cachedDataset(csvFile):
+    df = readCsv(csvFile)
+    dataset = Dataset.fromDataFrame(df[["page", "label", "box", "score"]],
+                                    df.columns, csvFile)
+    dataset.sourceSignature = csvSignature(csvFile)
+    return dataset
+
+
+def test_snapshot_reads_nothing(csvFile, tmp_path):
+    dataset = cachedDataset(csvFile)
+    dataset.append(rowData("p0", "x", (0, 0, 1, 1), comment="added"))
+    snapshot = dataset.snapshot()
+    assert dataset.lazyColumns() == ["comment"]
+    output = str(tmp_path / "saved.csv")
+    snapshot.save(output)
+    saved = readCsv(output)
+    assert saved["comment"][3] == "note 3"
+    assert saved["comment"][50] == "added"
+
+
+def test_snapshot_of_changed_source_fails(csvFile, tmp_path):
+    snapshot = cachedDataset(csvFile).snapshot()
+    with open(csvFile, "a") as file:
+        file.write("p0,l,0x0x1x1,0.5,late\n")
+    with pytest.raises(ValueError):
+        snapshot.save(str(tmp_path / "saved.csv"))
+
+
+def test_rebase_after_save(csvFile):
+    dataset = cachedDataset(csvFile)
+    dataset.delete(0)
+    dataset.append(rowData("p0", "x", (0, 0, 1, 1), comment="added"))
+    keys = dataset.keys()
+    dataset.save(csvFile)
+    dataset.rebase(keys, csvSignature(csvFile))
+    dataset.delete(0)
+    dataset.save(csvFile)
+    saved = readCsv(csvFile)
+    assert len(saved) == 49
+    assert saved["comment"][0] == "note 2"
+    assert saved["comment"][48] == "added"
+
+
+def test_row_deleted_before_a_save_keeps_lazy_columns(csvFile):
+    dataset = cachedDataset(csvFile)
+    row = dataset.row(1)
+    dataset.delete(1)
+    keys = dataset.keys()
+    dataset.save(csvFile)
+    dataset.rebase(keys, csvSignature(csvFile))
+    dataset.insert(1, row)
+    dataset.save(csvFile)
+    saved = readCsv(csvFile)
+    assert len(saved) == 50
+    assert saved["comment"][1] == "note 1"
+
+
+def test_set_columns(csvFile):
+    dataset = cachedDataset(csvFile)
+    dataset.delete(0)
+    dataset.setColumns(["comment"], {"comment": readCsv(csvFile)[
+        "comment"].to_numpy(dtype=object)})
+    assert dataset.isLoaded("comment")
+    assert dataset.get("comment", 0) == "note 1"
+
+
+def test_compressed_round_trip(csvFile, tmp_path):
+    dataset = Dataset.fromDataFrame(readCsv(csvFile))
+    output = str(tmp_path / "saved.csv.gz")
+    dataset.save(output)
+    with open(output, "rb") as file:
+        assert file.read(2) == b"\x1f\x8b"
+    columns = readCsvHeader(output)
+    chunks = list(readCsvChunks(output, columns, 7, 20))
+    assert sum(len(chunk) for chunk in chunks) == 50
+    assert chunks[-1]["comment"].tolist()[-1] == "note 49"
+
+
+def test_truncated_compressed_file_is_a_read_error(csvFile, tmp_path):
+    output = str(tmp_path / "saved.csv.gz")
+    Dataset.fromDataFrame(readCsv(csvFile)).save(output)
+    with open(output, "rb") as file:
+        data = file.read()
+    with open(output, "wb") as file:
+        file.write(data[:len(data) // 2])
+    with pytest.raises(READ_ERRORS):
+        for chunk in readCsvChunks(output, readCsvHeader(output), 7, 20):
+            pass
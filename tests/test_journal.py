@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `pyqt_corrector.journal`."""
+
+import os
+import pytest
+
+from pyqt_corrector.dataset import openDataset, csvSignature
+from pyqt_corrector.journal import Journal, journalPath, replayJournal
+
+
+@pytest.fixture
+def csvFile(tmp_path):
+    filename = str(tmp_path / "dataset.csv")
+    with open(filename, "w") as file:
+        file.write("page,label,box\n")
+        for i in range(10):
+            file.write(f"p{i % 2},l{i},{i}x{i}x{i + 5}x{i + 5}\n")
+    return filename
+
+
+def record(journal, dataset, rec):
+    replayJournal(dataset, [dict(rec)])
+    return journal.append(rec)
+
+
+def test_replay_recovers_edits(csvFile):
+    journal = Journal(csvFile)
+    assert journal.load() == []
+    dataset = openDataset(csvFile)
+    record(journal, dataset, {"op": "label", "row": 1, "label": "x"})
+    record(journal, dataset, {"op": "box", "row": 2, "box": [1, 2, 3, 4]})
+    record(journal, dataset, {"op": "delete", "row": 0})
+    rowData = {"page": "p9", "label": "y", "box": [0, 0, 1, 1]}
+    record(journal, dataset, {"op": "insert", "row": 3, "data": rowData})
+    journal.close()
+
+    recovered = Journal(csvFile)
+    records = recovered.load()
+    assert len(records) == 4
+    assert recovered.revision == 4
+    replayed = openDataset(csvFile)
+    replayJournal(replayed, records)
+    assert len(replayed) == len(dataset)
+    for col in ["page", "label", "box"]:
+        assert (replayed.column(col) == dataset.column(col)).all()
+
+
+def test_truncated_record_is_dropped(csvFile):
+    journal = Journal(csvFile)
+    journal.load()
+    journal.append({"op": "label", "row": 1, "label": "x"})
+    journal.close()
+    with open(journalPath(csvFile), "a") as file:
+        file.write('{"op": "label", "row"')
+    records = Journal(csvFile).load()
+    assert [rec["label"] for rec in records] == ["x"]
+
+
+def test_saved_folds_records(csvFile):
+    journal = Journal(csvFile)
+    journal.load()
+    journal.append({"op": "label", "row": 1, "label": "x"})
+    revision = journal.append({"op": "label", "row": 2, "label": "y"})
+    journal.append({"op": "label", "row": 3, "label": "z"})
+    journal.saved(revision, csvSignature(csvFile))
+    records = Journal(csvFile).load()
+    assert [rec["label"] for rec in records] == ["z"]
+    journal.saved(journal.revision, csvSignature(csvFile))
+    assert not os.path.exists(journalPath(csvFile))
+
+
+def test_journal_of_another_file_version_is_ignored(csvFile):
+    journal = Journal(csvFile)
+    journal.load()
+    journal.append({"op": "label", "row": 1, "label": "x"})
+    journal.close()
+    with open(csvFile, "a") as file:
+        file.write("p0,l,0x0x1x1\n")
+    assert Journal(csvFile).load() == []
+
+
+def test_records_are_written_on_flush(csvFile):
+    journal = Journal(csvFile)
+    journal.load()
+    journal.append({"op": "label", "row": 1, "label": "x"})
+    assert Journal(csvFile).load() == []
+    journal.flush()
+    assert len(Journal(csvFile).load()) == 1
+    journal.close()
+
+
+def test_consecutive_edits_of_a_row_are_merged(csvFile):
+    journal = Journal(csvFile)
+    journal.load()
+    for i in range(5):
+        journal.append({"op": "box", "row": 2, "box": [i, i, 9, 9]})
+    journal.append({"op": "box", "row": 3, "box": [0, 0, 1, 1]})
+    journal.append({"op": "box", "row": 2, "box": [7, 7, 9, 9]})
+    assert len(journal) == 3
+    journal.flush()
+    journal.append({"op": "box", "row": 2, "box": [8, 8, 9, 9]})
+    journal.close()
+    records = Journal(csvFile).load()
+    assert [rec["rev"] for rec in records] == [5, 6, 7, 8]
+    dataset = openDataset(csvFile)
+    replayJournal(dataset, records)
+    assert dataset.get("box", 2).tolist() == [8, 8, 9, 9]
+    assert dataset.get("box", 3).tolist() == [0, 0, 1, 1]
+
+
+def test_journal_of_a_missing_file(tmp_path):
+    with pytest.raises(OSError):
+        Journal(str(tmp_path / "missing.csv")).load()